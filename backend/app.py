@@ -2,7 +2,11 @@ import os
 import logging
 from flask import Flask, request, send_from_directory
 from dotenv import load_dotenv
-from backend.extensions import db, migrate
+
+# Load environment variables before the backend modules below read them at import
+load_dotenv()
+
+from backend.extensions import db, migrate, ENGINE_OPTIONS
 from backend.routes.chatbot import chatbot_bp  # Import chatbot route
 import requests  # For Messenger API
 
@@ -12,9 +16,6 @@ from backend.models import User, Lead, BankRate  # Removed ChatflowTemp and Chat
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
-# Load environment variables
-load_dotenv()
-
 
 def create_app(environ=None, start_response=None):
     """Create and configure the Flask app."""
@@ -30,6 +31,10 @@ def create_app(environ=None, start_response=None):
     app.config['SQLALCHEMY_DATABASE_URI'] = database_url
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+    # Queue pool tuning only applies to server databases, not SQLite
+    if not database_url.startswith('sqlite'):
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = ENGINE_OPTIONS
+
     # Initialize database and migrate
     db.init_app(app)
     migrate.init_app(app, db)
@@ -3,3 +3,14 @@ from flask_migrate import Migrate
 
 db = SQLAlchemy()  # ✅ Single instance of db
 migrate = Migrate()  # ✅ Single instance of migrate
+
+# Connection pool settings for server databases (Postgres): validate connections
+# before use, recycle them before the server drops them, and reuse the most recent ones
+ENGINE_OPTIONS = {
+    'pool_size': 20,
+    'max_overflow': 30,
+    'pool_timeout': 30,
+    'pool_recycle': 1800,
+    'pool_pre_ping': True,
+    'pool_use_lifo': True
+}
@@ -1,11 +1,16 @@
 from datetime import datetime
 from backend.extensions import db
 import pytz
-from sqlalchemy import Column, Integer, String, DateTime, Float, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, DateTime, Float, ForeignKey, JSON, Numeric, REAL
 
 # Malaysia timezone
 MYT = pytz.timezone('Asia/Kuala_Lumpur')
 
+# Ringgit amounts are exact to the sen; tenures are (possibly fractional) years.
+# Both still load as Python floats so the calculation code is unchanged.
+Money = Numeric(12, 2, asdecimal=False)
+Years = REAL
+
 # ----------------------------
 # Users Table (Simplified)
 # ----------------------------
@@ -15,34 +20,37 @@ from backend.extensions import db
 
 class User(db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        # Every incoming message looks its user up by messenger_id
+        db.UniqueConstraint('messenger_id', name='uq_users_messenger_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    messenger_id = db.Column(db.String(50), unique=True, nullable=False)
+    messenger_id = db.Column(db.String(50), nullable=False)
     name = db.Column(db.String(100))
     phone_number = db.Column(db.String(15))
     language = db.Column(db.String(10))
     state = db.Column(db.String(50))
 
     # Path A fields
-    outstanding_balance = db.Column(db.Float)
+    outstanding_balance = db.Column(Money)
     current_interest_rate = db.Column(db.Float)
-    remaining_tenure = db.Column(db.Float)
+    remaining_tenure = db.Column(Years)
 
     # Path B fields
-    original_amount = db.Column(db.Float)
-    original_tenure = db.Column(db.Float)
-    current_monthly_payment = db.Column(db.Float)
-    years_paid = db.Column(db.Float)
-
-    monthly_savings = db.Column(db.Float)
-    yearly_savings = db.Column(db.Float)
-    total_savings = db.Column(db.Float)
-    tenure = db.Column(db.Float)
-    current_rate = db.Column(db.Float)
+    original_amount = db.Column(Money)
+    original_tenure = db.Column(Years)
+    current_monthly_payment = db.Column(Money)
+    years_paid = db.Column(Years)
+
+    monthly_savings = db.Column(Money)
+    yearly_savings = db.Column(Money)
+    total_savings = db.Column(Money)
+    tenure = db.Column(Years)
     new_rate = db.Column(db.Float)
 
     # Cash-Out fields
-    temp_cashout_amount = db.Column(db.Float)  # Added field
+    temp_cashout_amount = db.Column(Money)  # Added field
 
     # New field for tracking last interaction
     last_interaction = db.Column(db.DateTime, default=datetime.utcnow)  # Add this line
@@ -85,6 +93,10 @@ class Lead(db.Model):
 # ----------------------------
 class BankRate(db.Model):
     __tablename__ = 'bank_rates'
+    __table_args__ = (
+        # Covers the loan-amount range lookup ordered by rate
+        db.Index('ix_bankrate_range_rate', 'min_amount', 'max_amount', 'interest_rate'),
+    )
 
     id = db.Column(Integer, primary_key=True, autoincrement=True)
     bank_name = db.Column(String(100), nullable=False)
@@ -3,12 +3,19 @@
 import os
 import re
 import logging
-import requests
 import openai
 import json
-from flask import Blueprint, request, jsonify
+import unicodedata
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from flask import Blueprint, request, jsonify, current_app
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
 from backend.extensions import db
-from backend.models import User, Lead, BankRate
+from backend.models import User, Lead
+from backend.utils.calculation import find_best_bank_rate
+from backend.utils.messenger import send_messenger_message, send_sender_action
+from backend.utils.rate_limit import OPENAI_LIMITER, estimate_tokens
 from datetime import datetime
 from datetime import timedelta
 
@@ -22,6 +29,25 @@ logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %
 # Set OpenAI API key
 openai.api_key = os.getenv("OPENAI_API_KEY").strip()
 
+# Messenger settings, read once at import
+ADMIN_MESSENGER_ID = os.getenv('ADMIN_MESSENGER_ID')
+ADMIN_ENABLED = bool(ADMIN_MESSENGER_ID and ADMIN_MESSENGER_ID.isdigit())
+
+# Worker pool for webhook events and GPT replies so the webhook can acknowledge Facebook right away
+MESSAGE_CONCURRENCY = int(os.getenv('MESSAGE_CONCURRENCY', '8'))
+EXECUTOR = ThreadPoolExecutor(max_workers=MESSAGE_CONCURRENCY)
+
+# Streamed GPT replies go out in pieces of at least this many characters, cut at a line or sentence end
+STREAM_FLUSH_CHARS = 160
+# Messenger rejects text messages longer than this
+MESSENGER_TEXT_LIMIT = 2000
+# Cut points: a newline, or ./!/? followed by whitespace. A period after a number that starts a
+# line or follows a space ("3.", "10.") is a list marker, not a sentence end; "RM12,000." still is.
+_SENTENCE_END_RE = re.compile(r'\n|(?:(?<![\n ]\d)(?<![\n ]\d\d)(?<!^\d)(?<!^\d\d)\.|[!?])\s')
+
+# INSERT ... ON CONFLICT constructs for the databases the app runs on (Postgres in production, SQLite locally)
+_UPSERT_INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
 # Define the handle_contact_admin function FIRST
 def handle_contact_admin(user: User, messenger_id: str, user_input: str):
     """
@@ -42,7 +68,6 @@ def handle_contact_admin(user: User, messenger_id: str, user_input: str):
 
     # Update state to WAITING_INPUT for follow-up inquiries
     user.state = STATES['WAITING_INPUT']
-    db.session.commit()
 
 STATES = {
     'GET_STARTED_YES': 'GET_STARTED_YES',  # New state for starting the process
@@ -83,6 +108,73 @@ STATES = {
 # Language mapping
 LANGUAGES = {'LANG_EN': 'en', 'LANG_MS': 'ms', 'LANG_ZH': 'zh'}
 
+# Keywords and phrases that mean the user wants a human (matched anywhere in the text)
+ADMIN_KEYWORDS = (
+    'admin', 'agent', 'contact', 'human', 'person', 'representative',
+    'staff', 'support', 'help desk', 'helpdesk', 'customer service',
+    'speak to someone', 'talk to someone', 'real person', 'live chat'
+)
+ADMIN_PHRASES = (
+    'can i speak to', 'want to speak', 'need to speak',
+    'can i talk to', 'want to talk', 'need to talk',
+    'connect me', 'transfer me', 'get in touch'
+)
+ADMIN_REQUEST_RE = re.compile('|'.join(map(re.escape, ADMIN_KEYWORDS + ADMIN_PHRASES)), re.IGNORECASE)
+
+# Cash-out breakdown shared by the user summary and the admin notification
+CASHOUT_CALCULATION_TEMPLATE = (
+    "📊 Cash-Out Calculation:\n"
+    "• Main Loan: RM{main_loan:,.2f} @ {cashout_rate:.2f}% for {main_tenure} yrs => RM{main_monthly:,.2f}/month\n"
+    "• Cash-Out: RM{cashout_amount:,.2f} @ {cashout_rate:.2f}% for 10 yrs => RM{cashout_monthly:,.2f}/month\n\n"
+    "💳 Total Monthly Payment: RM{total_monthly:,.2f}"
+)
+
+# Admin notification body, filled in with str.format_map by build_admin_summary
+ADMIN_SUMMARY_TEMPLATE = (
+    "📊 Loan Details:\n"
+    "• Outstanding Balance: RM{outstanding_balance:,.2f}\n"
+    "• Interest Rate: {current_interest_rate:.2f}%\n"
+    "• Remaining Tenure: {remaining_tenure:.1f} years\n\n"
+    "After Refinancing:\n"
+    "• New Interest Rate: {new_rate:.2f}%\n"
+    "• Monthly Savings: RM{monthly_savings:.2f}\n"
+    "• Yearly Savings: RM{yearly_savings:.2f}\n"
+    "• Total Savings: RM{total_savings:.2f}\n"
+    "• Tenure: {tenure:.1f} years\n\n"
+    "{cashout_calculation}\n\n"
+    "Status: {status}"
+)
+
+# Fixed Messenger payloads, built once and shared by every send
+INITIAL_MESSAGE = {
+    "text": (
+        "👋 Welcome to *Finzo AI Assistant*!\n\n"
+        "• I’m here to help you explore refinancing options.\n"
+        "• We’ll work together to optimize your housing loans.\n"
+        "• My goal is to help you identify potential savings* and *improve financial efficiency*.\n\n"
+        "Are you ready to get started?"
+    ),
+    "quick_replies": [
+        {
+            "content_type": "text",
+            "title": "Yes, let's start!",
+            "payload": "GET_STARTED_YES"
+        },
+        {
+            "content_type": "text",
+            "title": "Contact Admin",
+            "payload": "CONTACT_ADMIN"
+        }
+    ]
+}
+
+WELCOME_BACK_MESSAGE = {
+    "text": (
+        "Hi, welcome back! 👋\n\n"
+        "If you need to calculate again, please type 'restart'."
+    )
+}
+
 # Load presets.json for FAQs
 PRESETS_FILE = os.path.abspath(
     os.path.join(os.path.dirname(__file__), '..', 'utils', 'presets.json')
@@ -93,35 +185,48 @@ try:
         presets_data = json.load(f)
         FAQs = presets_data.get("faqs", [])
 except FileNotFoundError:
-    logging.error(f"presets.json not found at {PRESETS_FILE}. Ensure the file exists.")
+    logging.error("presets.json not found at %s. Ensure the file exists.", PRESETS_FILE)
     FAQs = []
 except json.JSONDecodeError as e:
-    logging.error(f"Error decoding presets.json: {e}")
+    logging.error("Error decoding presets.json: %s", e)
     FAQs = []
 
+# Amounts like '350k', '1.2m' or 'RM50,000' (after dropping commas and spaces)
+_AMOUNT_RE = re.compile(r'(?:rm)?(\d+(?:\.\d+)?|\.\d+)([km]?)')
+_AMOUNT_MULTIPLIERS = {'': 1, 'k': 1_000, 'm': 1_000_000}
+# Largest amount accepted from the user
+MAX_AMOUNT = 100_000_000
+# Largest value the users Numeric(12, 2) money columns can hold
+MAX_STORED_MONEY = 9_999_999_999.99
+
+# Names: Unicode letters, combining marks (e.g. Tamil vowel signs) and spaces, 2-50 characters
+_NAME_MARK_CATEGORIES = ('Mn', 'Mc')
+
 # Helper Functions
 def parse_number_with_suffix(user_input: str) -> float:
     """
     Converts inputs like '350k' to 350000, '1.2m' to 1200000, etc.
     """
-    text = user_input.lower().replace(",", "").replace(" ", "")
-    multiplier = 1
-    if 'm' in text:
-        multiplier = 1_000_000
-        text = text.replace('m', '')
-    elif 'k' in text:
-        multiplier = 1_000
-        text = text.replace('k', '')
-    try:
-        return float(text) * multiplier
-    except ValueError:
+    match = _AMOUNT_RE.fullmatch(user_input.lower().replace(",", "").replace(" ", ""))
+    if not match:
         raise ValueError("Invalid number format")
+    value = float(match.group(1)) * _AMOUNT_MULTIPLIERS[match.group(2)]
+    if value > MAX_AMOUNT:
+        raise ValueError("Amount out of range")
+    return value
+
+def money_fits(*values: float) -> bool:
+    """True if every value can be stored in the users money columns."""
+    return all(abs(value) <= MAX_STORED_MONEY for value in values)
 
 def is_valid_name(name: str) -> bool:
     """
-    Validates that the name contains only alphabetic characters and is between 2 and 50 characters.
+    Validates that the name contains only letters (any script, with their combining marks) and spaces
+    and is between 2 and 50 characters.
     """
-    return bool(re.fullmatch(r"[A-Za-z\s]{2,50}", name))
+    return 2 <= len(name) <= 50 and all(
+        c.isalpha() or c.isspace() or unicodedata.category(c) in _NAME_MARK_CATEGORIES for c in name
+    )
 
 def is_valid_phone(phone: str) -> bool:
     """
@@ -148,13 +253,32 @@ def calculate_monthly_payment(principal: float, annual_interest_rate: float, yea
         return 0.0
     r = (annual_interest_rate / 100.0) / 12.0
     n = years * 12
-    numerator = r * (1 + r)**n
-    denominator = (1 + r)**n - 1
+    growth = (1 + r)**n  # Compound factor, computed once
+    denominator = growth - 1
     if denominator == 0:
         return 0.0
-    monthly = principal * (numerator / denominator)
+    monthly = principal * (r * growth / denominator)
     return monthly
 
+def build_admin_summary(user: User, cashout_calculation: str, status: str) -> str:
+    """
+    Fills ADMIN_SUMMARY_TEMPLATE with the user's loan details, an already formatted
+    CASHOUT_CALCULATION_TEMPLATE block and the cash-out status.
+    """
+    values = {
+        'outstanding_balance': user.outstanding_balance or 0,
+        'current_interest_rate': user.current_interest_rate or 0,
+        'remaining_tenure': user.remaining_tenure or 0,
+        'new_rate': user.new_rate or 0,
+        'monthly_savings': user.monthly_savings or 0,
+        'yearly_savings': user.yearly_savings or 0,
+        'total_savings': user.total_savings or 0,
+        'tenure': user.tenure or 0,
+        'cashout_calculation': cashout_calculation,
+        'status': status
+    }
+    return ADMIN_SUMMARY_TEMPLATE.format_map(values)
+
 def estimate_loan_details(original_amount: float, original_tenure: float, current_monthly_payment: float, years_paid: float):
     """
     Estimates outstanding balance and remaining tenure based on inputs.
@@ -166,12 +290,12 @@ def estimate_loan_details(original_amount: float, original_tenure: float, curren
 
     r = (guessed_rate / 100.0) / 12.0
     n = remain_tenure * 12
-    numerator = r * (1 + r)**n
-    denominator = (1 + r)**n - 1
+    growth = (1 + r)**n  # Compound factor, computed once
+    denominator = growth - 1
     if denominator == 0:
         outstanding_guess = original_amount
     else:
-        factor = numerator / denominator
+        factor = r * growth / denominator
         outstanding_guess = current_monthly_payment / factor
 
     return guessed_rate, outstanding_guess, remain_tenure
@@ -187,45 +311,17 @@ def get_current_bank_rate(loan_size: float) -> float:
             logging.error("Loan size is None or invalid. Defaulting to 3.8% rate.")
             return 3.8  # Default rate
 
-        # Query the database for matching rate
-        matching_rate = BankRate.query.filter(
-            BankRate.min_amount <= loan_size,
-            ((BankRate.max_amount >= loan_size) | (BankRate.max_amount.is_(None)))
-        ).order_by(BankRate.interest_rate.asc()).first()
+        # Look up the matching rate in the in-process BankRate cache
+        matching_rate = find_best_bank_rate(loan_size)
 
         if matching_rate:
-            return matching_rate.interest_rate
+            return matching_rate[2]
         else:
             return 3.8  # Fallback rate
-    except Exception as e:
-        logging.error(f"Error fetching bank rate: {e}")
+    except Exception:
+        logging.exception("Error fetching bank rate")
         return 3.8  # Fallback rate
 
-def send_initial_message(messenger_id):
-    message = {
-        "text": (
-            "👋 Welcome to Finzo AI Assistant!\n\n"
-            "• I’m here to help you explore refinancing options.\n"
-            "• We’ll work together to optimize your housing loans.\n"
-            "• My goal is to help you identify potential savings and improve financial efficiency.\n\n"
-            "Are you ready to get started?"
-        ),
-        "quick_replies": [
-            {
-                "content_type": "text",
-                "title": "Yes, let's start!",
-                "payload": "GET_STARTED_YES"
-            },
-            {
-                "content_type": "text",
-                "title": "I want to talk to admin",
-                "payload": "CONTACT_ADMIN"
-            }
-        ]
-    }
-    send_messenger_message(messenger_id, message)
-    logging.debug("Initial welcome message sent.")
-
 def handle_get_started_yes(user: User, messenger_id: str, user_input: str):
     """
     Handles the 'Yes, let's start!' response and proceeds to collect the user's name.
@@ -234,7 +330,6 @@ def handle_get_started_yes(user: User, messenger_id: str, user_input: str):
 
     # Move the user to the NAME_COLLECTION state
     user.state = STATES['NAME_COLLECTION']
-    db.session.commit()
 
     # Ask for the user's name
     message = {
@@ -291,7 +386,7 @@ def generate_convincing_message(savings_data: dict) -> str:
                 }
             ]
 
-
+        OPENAI_LIMITER.acquire(estimate_tokens(conversation))
         response = openai.ChatCompletion.create(
             model="gpt-3.5-turbo",
             messages=conversation,
@@ -300,44 +395,71 @@ def generate_convincing_message(savings_data: dict) -> str:
 
         return response.choices[0].message.content.strip()
 
-    except Exception as e:
-        logging.error(f"Error generating convincing message: {e}")
+    except Exception:
+        logging.exception("Error generating convincing message")
         return (
             f"You may be overpaying on your home loan. Refinancing at {savings_data.get('new_rate', 0):.2f}% could save you "
             f"RM{savings_data.get('monthly_savings', 0):.2f} monthly and RM{savings_data.get('total_savings', 0):,.2f} over {savings_data.get('tenure', 0)} years. "
             "Our service is completely free, and our agents are here to assist—unless you say 'no,' we'll be in touch to help you explore your savings. Feel free to ask any follow-up questions!"
         )
 
-def generate_faq_response_with_gpt(user_input: str) -> str:
+def _stream_cut(buffer: str) -> int:
+    """
+    Where to split a streamed reply: after the last line or sentence end that keeps the piece within
+    MESSENGER_TEXT_LIMIT, or at the last space once the buffer reaches the limit. 0 means keep buffering.
     """
-    Uses GPT to generate a response for an unmatched FAQ.
+    window = buffer[:MESSENGER_TEXT_LIMIT]
+    cut = 0
+    for match in _SENTENCE_END_RE.finditer(window):
+        cut = match.end()
+    if not cut and len(buffer) >= MESSENGER_TEXT_LIMIT:
+        cut = window.rfind(' ') + 1 or MESSENGER_TEXT_LIMIT
+    return cut
+
+def _do_gpt_reply(messenger_id: str, conversation: list, language: str, max_tokens: int = None, fallback_text: str = None):
     """
+    Runs on EXECUTOR: streams a GPT reply for the conversation and sends it to the user
+    piece by piece, showing the typing indicator while more is coming.
+    Falls back to fallback_text if the OpenAI call fails before anything was sent.
+    """
+    sent_any = False
     try:
-        conversation = [
-            {
-                "role": "system",
-                "content": (
-                    "You are Finzo AI Buddy, a friendly and professional assistant. "
-                    "Answer the user's question accurately and concisely."
-                )
-            },
-            {
-                "role": "user",
-                "content": user_input
-            }
-        ]
-
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=conversation,
-            temperature=0.7
-        )
-        gpt_response = response.choices[0].message.content.strip()
-        return gpt_response
-
-    except Exception as e:
-        logging.error(f"Error generating FAQ response with GPT: {e}")
-        return "I'm sorry, I don't have an answer to that. You can ask anything regarding refinancing and housing loans."
+        params = {
+            "model": "gpt-3.5-turbo",
+            "messages": conversation,
+            "temperature": 0.7,
+            "stream": True
+        }
+        if max_tokens:
+            params["max_tokens"] = max_tokens
+
+        send_sender_action(messenger_id, "typing_on")
+        OPENAI_LIMITER.acquire(estimate_tokens(conversation, max_tokens))
+        buffer = ""
+        for chunk in openai.ChatCompletion.create(**params):
+            buffer += chunk["choices"][0]["delta"].get("content") or ""
+            # Send everything up to the last complete line or sentence
+            while len(buffer) >= STREAM_FLUSH_CHARS:
+                cut = _stream_cut(buffer)
+                if not cut:
+                    break
+                piece = buffer[:cut].strip()
+                buffer = buffer[cut:]
+                if piece:
+                    send_messenger_message(messenger_id, {"text": piece})
+                    sent_any = True
+                    send_sender_action(messenger_id, "typing_on")
+
+        if buffer.strip():
+            send_messenger_message(messenger_id, {"text": buffer.strip()})
+            sent_any = True
+        logging.debug("GPT reply sent to user (language: %s).", language)
+
+    except Exception:
+        logging.exception("Error generating GPT reply")
+        if fallback_text and not sent_any:
+            send_messenger_message(messenger_id, {"text": fallback_text})
+            logging.debug("GPT reply failed. Sent fallback message to user.")
 
 # Handler Functions
 def handle_language_selection(user: User, messenger_id: str, user_input: str):
@@ -350,7 +472,6 @@ def handle_language_selection(user: User, messenger_id: str, user_input: str):
     if user_input in language_map:
         user.language = language_map[user_input]
         user.state = STATES['NAME_COLLECTION']
-        db.session.commit()
 
         question = "Great! What's your name?"
         message = {
@@ -378,7 +499,6 @@ def handle_name_collection(user: User, messenger_id: str, user_input: str):
 
     user.name = name
     user.state = STATES['PHONE_COLLECTION']
-    db.session.commit()
 
     question = "May I have your phone number to proceed further?"
     message = {
@@ -399,7 +519,6 @@ def handle_phone_collection(user: User, messenger_id: str, user_input: str):
 
     user.phone_number = phone
     user.state = STATES['PATH_SELECTION']
-    db.session.commit()
 
     message = {
         "text": (
@@ -425,7 +544,6 @@ def handle_phone_collection(user: User, messenger_id: str, user_input: str):
 def handle_path_selection(user: User, messenger_id: str, user_input: str):
     if user_input == "KNOW_DETAILS_YES":
         user.state = STATES['PATH_A_GATHER_BALANCE']
-        db.session.commit()
         question = (
             "Could you share your outstanding loan amount?\n\n"
             "Key in digits, for example: 500k or 500000"
@@ -435,7 +553,6 @@ def handle_path_selection(user: User, messenger_id: str, user_input: str):
         logging.debug("Path A selected: Gather outstanding balance.")
     elif user_input == "KNOW_DETAILS_NO":
         user.state = STATES['PATH_B_GATHER_ORIGINAL_AMOUNT']
-        db.session.commit()
         question = (
             "Could you let us know the original loan amount?\n\n"
             "Key in digits, for example: 500k or 500000"
@@ -464,7 +581,6 @@ def handle_path_a_balance(user: User, messenger_id: str, user_input: str):
     # Save balance and move to the next step
     user.outstanding_balance = balance
     user.state = STATES['PATH_A_GATHER_INTEREST']
-    db.session.commit()
 
     question = "What is your current interest rate (in %)?"
     message = {"text": question}
@@ -485,7 +601,6 @@ def handle_path_a_interest(user: User, messenger_id: str, user_input: str):
 
     user.current_interest_rate = interest
     user.state = STATES['PATH_A_GATHER_TENURE']
-    db.session.commit()
 
     question = "How many years remain on your loan tenure?"
     message = {
@@ -508,7 +623,6 @@ def handle_path_a_tenure(user: User, messenger_id: str, user_input: str):
 
     user.remaining_tenure = tenure
     user.state = STATES['PATH_A_CALCULATE']
-    db.session.commit()
 
     handle_path_a_calculate(user, messenger_id)
     logging.debug("Remaining tenure collected and Path A calculation initiated.")
@@ -537,6 +651,11 @@ def handle_path_a_calculate(user: User, messenger_id: str, *args):
     yearly_savings = monthly_savings * 12
     total_savings = monthly_savings * tenure * 12
 
+    if not money_fits(monthly_savings, yearly_savings, total_savings):
+        send_messenger_message(messenger_id, {"text": "Those figures are too large to calculate. Please type 'restart' and check your details."})
+        logging.warning("Path A results out of range for messenger_id %s.", messenger_id)
+        return
+
     user.monthly_savings = monthly_savings
     user.yearly_savings = yearly_savings
     user.total_savings = total_savings
@@ -544,8 +663,6 @@ def handle_path_a_calculate(user: User, messenger_id: str, *args):
     user.current_interest_rate = interest
     user.new_rate = new_rate
 
-    db.session.commit()
-
     # Send calculation summary
     summary = (
         f"🏦 Current Loan:\n"
@@ -583,7 +700,6 @@ def handle_path_b_original_amount(user: User, messenger_id: str, user_input: str
 
     user.original_amount = amt
     user.state = STATES['PATH_B_GATHER_ORIGINAL_TENURE']
-    db.session.commit()
 
     message = {
         "text": "May I know the original loan tenure in years?"
@@ -604,7 +720,6 @@ def handle_path_b_original_tenure(user: User, messenger_id: str, user_input: str
 
     user.original_tenure = tenure
     user.state = STATES['PATH_B_GATHER_MONTHLY_PAYMENT']
-    db.session.commit()
 
     message = {
         "text": "What is your current monthly payment/installment?"
@@ -625,7 +740,6 @@ def handle_path_b_monthly_payment(user: User, messenger_id: str, user_input: str
 
     user.current_monthly_payment = monthly
     user.state = STATES['PATH_B_GATHER_YEARS_PAID']
-    db.session.commit()
 
     message = {
         "text": "How many years have you paid so far?"
@@ -646,7 +760,6 @@ def handle_path_b_years_paid(user: User, messenger_id: str, user_input: str):
 
     user.years_paid = yrs
     user.state = STATES['PATH_B_CALCULATE']
-    db.session.commit()
     handle_path_b_calculate(user, messenger_id)
     logging.debug("Years paid collected and Path B calculation initiated.")
 
@@ -663,7 +776,7 @@ def handle_path_b_calculate(user: User, messenger_id: str, *args):
     yrs_paid = user.years_paid
 
     # Validate inputs
-    if any(v is None for v in [orig_amt, orig_tenure, monthly_payment, yrs_paid]):
+    if orig_amt is None or orig_tenure is None or monthly_payment is None or yrs_paid is None:
         send_messenger_message(messenger_id, {"text": "Some data is missing. Please type 'restart' or re-enter the required details."})
         logging.error("Missing data for Path B calculation.")
         return
@@ -685,6 +798,11 @@ def handle_path_b_calculate(user: User, messenger_id: str, *args):
     yearly_savings = monthly_savings * 12
     total_savings = monthly_savings * remain_tenure * 12
 
+    if not money_fits(current_outstanding, monthly_savings, yearly_savings, total_savings):
+        send_messenger_message(messenger_id, {"text": "Those figures are too large to calculate. Please type 'restart' and check your details."})
+        logging.warning("Path B results out of range for messenger_id %s.", messenger_id)
+        return
+
     # Update user attributes
     user.monthly_savings = monthly_savings
     user.yearly_savings = yearly_savings
@@ -694,8 +812,6 @@ def handle_path_b_calculate(user: User, messenger_id: str, *args):
     user.new_rate = new_rate
     user.outstanding_balance = current_outstanding
 
-    db.session.commit()
-
     logging.debug("Path B calculation details updated for user.")
 
     # Send calculation summary
@@ -738,7 +854,7 @@ def handle_convince(user: User, messenger_id: str, user_input: str = ""):
         'new_rate': user.new_rate or 0
     }
 
-    logging.debug(f"Savings Data: {savings_data}")
+    logging.debug("Savings Data: %s", savings_data)
 
     # Generate the convincing message
     convincing_msg = generate_convincing_message(savings_data)
@@ -772,8 +888,70 @@ def handle_convince(user: User, messenger_id: str, user_input: str = ""):
 
     # Update user state to CASHOUT_OFFER
     user.state = STATES['CASHOUT_OFFER']
-    db.session.commit()
-    logging.debug(f"User state updated to {user.state}")
+    logging.debug("User state updated to %s", user.state)
+
+def _cashout_yes(user: User, messenger_id: str):
+    """
+    User accepted the cash-out offer: ask for the cash-out amount.
+    """
+    # Transition to gather cash-out amount
+    user.state = STATES['CASHOUT_GATHER_AMOUNT']
+    question = (
+        "Great! How much equity would you like to cash out from your property in Ringgit?\n\n "
+        "For example, RM50,000 or 50k."
+    )
+    send_messenger_message(messenger_id, {"text": question})
+    logging.debug("User accepted cash-out offer. Cash-out amount collection initiated.")
+
+def _cashout_no(user: User, messenger_id: str):
+    """
+    User declined the cash-out offer: notify admin and move on to the inquiry phase.
+    """
+    # Transition to WAITING_INPUT without cash-out
+    user.temp_cashout_amount = 0  # No cash-out
+    user.state = STATES['WAITING_INPUT']
+
+    # Notify admin about declined cash-out offer (summary is only built if an admin is configured)
+    if ADMIN_ENABLED:
+        # Cash-out amount was just set to 0, so its monthly payment is 0 as well
+        main_monthly = calculate_monthly_payment(user.outstanding_balance or 0, user.new_rate or 0, user.remaining_tenure or 0)
+        cashout_calculation = CASHOUT_CALCULATION_TEMPLATE.format(
+            main_loan=user.outstanding_balance or 0,
+            cashout_rate=user.new_rate or 0,
+            main_tenure=int(user.remaining_tenure or 0),
+            main_monthly=main_monthly,
+            cashout_amount=0.0,
+            cashout_monthly=0.0,
+            total_monthly=main_monthly
+        )
+        admin_summary = build_admin_summary(user, cashout_calculation, 'Declined Cash-Out Offer')
+        notify_admin(user, "User Declined Cash-Out Offer", admin_summary)
+        logging.debug("User declined cash-out offer and admin notified.")
+
+    # FAQ Prompt
+    faq_prompt = (
+        "You are now talking to Finzo AI. You can ask anything regarding refinancing and housing loans.\n\n"
+        "Common questions you might have:\n"
+        "• What documents do I need for refinancing?\n"
+        "• How long does the refinancing process take?\n"
+        "• Are there any fees involved?\n"
+        "• What factors affect my loan approval?"
+    )
+    send_messenger_message(messenger_id, {"text": faq_prompt})
+    logging.debug("FAQ prompt sent after declining cash-out offer.")
+
+def _cashout_unknown(user: User, messenger_id: str):
+    """
+    Unexpected reply to the cash-out offer: ask the user to pick an option.
+    """
+    send_messenger_message(messenger_id, {"text": "Please select 'Yes, tell me more' or 'No, thanks'."})
+    logging.debug("Unexpected input received for cash-out offer.")
+
+# Cash-out quick-reply payload -> handler
+_CASHOUT_DISPATCH = {
+    "CASHOUT_YES": _cashout_yes,
+    "CASHOUT_NO": _cashout_no
+}
 
 def handle_cashout_offer(user: User, messenger_id: str, user_input: str):
     """
@@ -803,61 +981,8 @@ def handle_cashout_offer(user: User, messenger_id: str, user_input: str):
         return
 
     # Handle user response
-    if user_input == "CASHOUT_YES":
-        # Transition to gather cash-out amount
-        user.state = STATES['CASHOUT_GATHER_AMOUNT']
-        db.session.commit()
-        question = (
-            "Great! How much equity would you like to cash out from your property in Ringgit?\n\n "
-        "For example, RM50,000 or 50k."
-        )
-        send_messenger_message(messenger_id, {"text": question})
-        logging.debug("User accepted cash-out offer. Cash-out amount collection initiated.")
-    elif user_input == "CASHOUT_NO":
-        # Transition to WAITING_INPUT without cash-out
-        user.temp_cashout_amount = 0  # No cash-out
-        user.state = STATES['WAITING_INPUT']
-        db.session.commit()
-
-        # Notify admin about declined cash-out offer
-        admin_summary = (
-            f"📊 User Declined Cash-Out Offer\n"
-            f"Customer: {user.name or 'N/A'}\n"
-            f"Contact: {user.phone_number or 'N/A'}\n\n"
-            f"📊 Loan Details:\n"
-            f"• Outstanding Balance: RM{user.outstanding_balance or 0:,.2f}\n"
-            f"• Interest Rate: {user.current_interest_rate or 0:.2f}%\n"
-            f"• Remaining Tenure: {user.remaining_tenure or 0:.1f} years\n\n"
-            f"After Refinancing:\n"
-            f"• New Interest Rate: {user.new_rate or 0:.2f}%\n"
-            f"• Monthly Savings: RM{user.monthly_savings or 0:.2f}\n"
-            f"• Yearly Savings: RM{user.yearly_savings or 0:.2f}\n"
-            f"• Total Savings: RM{user.total_savings or 0:.2f}\n"
-            f"• Tenure: {user.tenure or 0:.1f} years\n\n"
-            f"📊 Cash-Out Calculation:\n"
-            f"• Main Loan: RM{user.outstanding_balance or 0:,.2f} @ {user.new_rate or 0:.2f}% for {int(user.remaining_tenure or 0)} yrs => RM{calculate_monthly_payment(user.outstanding_balance or 0, user.new_rate or 0, user.remaining_tenure or 0):,.2f}/month\n"
-            f"• Cash-Out: RM{user.temp_cashout_amount or 0:,.2f} @ {user.new_rate or 0:.2f}% for 10 yrs => RM{calculate_monthly_payment(user.temp_cashout_amount or 0, user.new_rate or 0, 10):,.2f}/month\n\n"
-            f"💳 Total Monthly Payment: RM{(calculate_monthly_payment(user.outstanding_balance or 0, user.new_rate or 0, user.remaining_tenure or 0) + calculate_monthly_payment(user.temp_cashout_amount or 0, user.new_rate or 0, 10)) or 0:,.2f}\n\n"
-            f"Status: {'Accepted Cash-Out Offer' if (user.temp_cashout_amount or 0) > 0 else 'Declined Cash-Out Offer'}"
-        )
-        notify_admin(user, "User Declined Cash-Out Offer", admin_summary)
-        logging.debug("User declined cash-out offer and admin notified.")
-
-        # FAQ Prompt
-        faq_prompt = (
-            "You are now talking to Finzo AI. You can ask anything regarding refinancing and housing loans.\n\n"
-            "Common questions you might have:\n"
-            "• What documents do I need for refinancing?\n"
-            "• How long does the refinancing process take?\n"
-            "• Are there any fees involved?\n"
-            "• What factors affect my loan approval?"
-        )
-        send_messenger_message(messenger_id, {"text": faq_prompt})
-        logging.debug("FAQ prompt sent after declining cash-out offer.")
-    else:
-        # Handle unexpected inputs
-        send_messenger_message(messenger_id, {"text": "Please select 'Yes, tell me more' or 'No, thanks'."})
-        logging.debug("Unexpected input received for cash-out offer.")
+    handler = _CASHOUT_DISPATCH.get(user_input, _cashout_unknown)
+    handler(user, messenger_id)
 
 def handle_cashout_gather_amount(user: User, messenger_id: str, user_input: str):
     logging.debug("Entering handle_cashout_gather_amount function.")
@@ -866,14 +991,13 @@ def handle_cashout_gather_amount(user: User, messenger_id: str, user_input: str)
         # Corrected function call
         cashout_amount = parse_number_with_suffix(user_input)
         user.temp_cashout_amount = cashout_amount
-        db.session.commit()
-        logging.debug(f"Cash-out amount {cashout_amount} set for user.")
+        logging.debug("Cash-out amount %s set for user.", cashout_amount)
 
         # Proceed to calculate the new loan details
         handle_cashout_calculate(user, messenger_id)
 
     except Exception as e:
-        logging.error(f"Error gathering cash-out amount: {e}")
+        logging.error("Error gathering cash-out amount: %s", e)
         send_messenger_message(
             messenger_id,
             {"text": "I'm sorry, I couldn't process that amount. Please enter a valid cash-out amount in Ringgit (e.g., RM50,000 or 50k)."}
@@ -902,13 +1026,21 @@ def handle_cashout_calculate(user: User, messenger_id: str, user_input: str = No
 
     new_total_monthly = monthly1 + monthly2
 
+    # Cash-out breakdown, formatted once for both the user and the admin
+    cashout_calculation = CASHOUT_CALCULATION_TEMPLATE.format(
+        main_loan=outstanding_balance,
+        cashout_rate=main_rate,
+        main_tenure=segment1_tenure,
+        main_monthly=monthly1,
+        cashout_amount=cashout_amount,
+        cashout_monthly=monthly2,
+        total_monthly=new_total_monthly
+    )
+
     # --- Message for USER ---
     user_summary = (
-        f"📊 Cash-Out Calculation:\n"
-        f"• Main Loan: RM{outstanding_balance:,.2f} @ {main_rate:.2f}% for {segment1_tenure} yrs => RM{monthly1:,.2f}/month\n"
-        f"• Cash-Out: RM{cashout_amount:,.2f} @ {main_rate:.2f}% for 10 yrs => RM{monthly2:,.2f}/month\n\n"
-        f"💳 Total Monthly Payment: RM{new_total_monthly:,.2f}\n\n"
-        f"Note: This is your updated estimated monthly repayment amount if the refinance and cash-out are approved and accepted."
+        f"{cashout_calculation}\n\n"
+        "Note: This is your updated estimated monthly repayment amount if the refinance and cash-out are approved and accepted."
     )
     # **Correction:** Remove the nested "message" key
     send_messenger_message(messenger_id, {"text": user_summary})
@@ -916,7 +1048,6 @@ def handle_cashout_calculate(user: User, messenger_id: str, user_input: str = No
 
     # Transition to WAITING_INPUT instead of FAQ
     user.state = STATES['WAITING_INPUT']
-    db.session.commit()
 
     # FAQ Prompt
     faq_prompt = (
@@ -929,29 +1060,15 @@ def handle_cashout_calculate(user: User, messenger_id: str, user_input: str = No
     send_messenger_message(messenger_id, {"text": faq_prompt})
     logging.debug("FAQ prompt sent after cash-out calculation.")
 
-    # Send admin notification
-    admin_summary = (
-        f"📊 Loan and Cash-Out Details:\n"
-        f"• Customer: {user.name}\n"
-        f"• Contact: {user.phone_number}\n\n"
-        f"Current Loan:\n"
-        f"• Outstanding Balance: RM{user.outstanding_balance:,.2f}\n"
-        f"• Interest Rate: {user.current_interest_rate:.2f}%\n"
-        f"• Remaining Tenure: {user.remaining_tenure:.1f} years\n\n"
-        f"After Refinancing:\n"
-        f"• New Interest Rate: {user.new_rate:.2f}%\n"
-        f"• Monthly Savings: RM{user.monthly_savings:.2f}\n"
-        f"• Yearly Savings: RM{user.yearly_savings:.2f}\n"
-        f"• Total Savings: RM{user.total_savings:.2f}\n"
-        f"• Tenure: {user.tenure:.1f} years\n\n"
-        f"📊 Cash-Out Calculation:\n"
-        f"• Main Loan: RM{outstanding_balance:,.2f} @ {main_rate:.2f}% for {segment1_tenure} yrs => RM{monthly1:,.2f}/month\n"
-        f"• Cash-Out: RM{cashout_amount:,.2f} @ {main_rate:.2f}% for 10 yrs => RM{monthly2:,.2f}/month\n\n"
-        f"💳 Total Monthly Payment: RM{new_total_monthly:,.2f}\n\n"
-        f"Status: {'Accepted Cash-Out Offer' if cashout_amount > 0 else 'Declined Cash-Out Offer'}"
-    )
-    notify_admin(user, "User Completed Cash-Out Refinance Calculation", admin_summary)
-    logging.debug("Admin notified about completed cash-out refinance calculation.")
+    # Send admin notification (summary is only built if an admin is configured)
+    if ADMIN_ENABLED:
+        admin_summary = build_admin_summary(
+            user,
+            cashout_calculation,
+            'Accepted Cash-Out Offer' if cashout_amount > 0 else 'Declined Cash-Out Offer'
+        )
+        notify_admin(user, "User Completed Cash-Out Refinance Calculation", admin_summary)
+        logging.debug("Admin notified about completed cash-out refinance calculation.")
 
 def handle_waiting_input(user: User, messenger_id: str, user_input: str):
     """
@@ -969,45 +1086,31 @@ def handle_waiting_input(user: User, messenger_id: str, user_input: str):
         f"Remaining Tenure: {user.remaining_tenure or user.tenure or 0} years\n"
     )
 
-    try:
-        conversation = [
-            {
-                "role": "system",
-                "content": (
-                    "You are Finzo AI Buddy, an expert in refinancing and loan advisory. "
-                    "Answer user questions based on their previous calculations. "
-                    "Use the following context to guide responses:\n"
-                    f"{context}"
-                )
-            },
-            {
-                "role": "user",
-                "content": user_input
-            }
-        ]
-
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=conversation,
-            temperature=0.7
-        )
-
-        reply = response.choices[0].message.content.strip()
-        # **Correction:** Remove the nested "message" key
-        send_messenger_message(messenger_id, {"text": reply})
-        logging.debug("User question processed and response sent.")
+    conversation = [
+        {
+            "role": "system",
+            "content": (
+                "You are Finzo AI Buddy, an expert in refinancing and loan advisory. "
+                "Answer user questions based on their previous calculations. "
+                "Use the following context to guide responses:\n"
+                f"{context}"
+            )
+        },
+        {
+            "role": "user",
+            "content": user_input
+        }
+    ]
 
-    except Exception as e:
-        logging.error(f"Error processing user question: {e}")
-        send_messenger_message(
-            messenger_id,
-            {"text": "I'm sorry, I couldn't process your request. An agent will follow up shortly to assist you."}
-        )
-        logging.debug("Error occurred while processing user question. Informed user.")
+    # Reply is generated and sent in the background
+    EXECUTOR.submit(
+        _do_gpt_reply, messenger_id, conversation, user.language,
+        fallback_text="I'm sorry, I couldn't process your request. An agent will follow up shortly to assist you."
+    )
+    logging.debug("User question queued for GPT reply.")
 
     # Remain in the same state to allow further questions
     user.state = STATES['WAITING_INPUT']
-    db.session.commit()
     logging.debug("User state remains at WAITING_INPUT.")
 
 def handle_faq(user: User, messenger_id: str, user_input: str):
@@ -1017,28 +1120,15 @@ def handle_faq(user: User, messenger_id: str, user_input: str):
     logging.debug("Entering handle_faq function.")
 
     # Debug logs for database values
-    logging.debug(f"Monthly Savings: {user.monthly_savings}")
-    logging.debug(f"Yearly Savings: {user.yearly_savings}")
-    logging.debug(f"Total Savings: {user.total_savings}")
-    logging.debug(f"Interest Rate: {user.current_interest_rate}")
-    logging.debug(f"New Rate: {user.new_rate}")
-    logging.debug(f"Remaining Tenure: {user.remaining_tenure}")
-
-    # Enhanced admin contact detection keywords and patterns
-    admin_keywords = [
-        'admin', 'agent', 'contact', 'human', 'person', 'representative',
-        'staff', 'support', 'help desk', 'helpdesk', 'customer service',
-        'speak to someone', 'talk to someone', 'real person', 'live chat'
-    ]
-
-    # Improved admin contact detection with pattern matching
-    user_input_lower = user_input.lower()
-    if any(keyword in user_input_lower for keyword in admin_keywords) or \
-       any(phrase in user_input_lower for phrase in [
-           'can i speak to', 'want to speak', 'need to speak',
-           'can i talk to', 'want to talk', 'need to talk',
-           'connect me', 'transfer me', 'get in touch'
-       ]):
+    logging.debug("Monthly Savings: %s", user.monthly_savings)
+    logging.debug("Yearly Savings: %s", user.yearly_savings)
+    logging.debug("Total Savings: %s", user.total_savings)
+    logging.debug("Interest Rate: %s", user.current_interest_rate)
+    logging.debug("New Rate: %s", user.new_rate)
+    logging.debug("Remaining Tenure: %s", user.remaining_tenure)
+
+    # Admin contact detection: one case-insensitive scan over all keywords and phrases
+    if ADMIN_REQUEST_RE.search(user_input):
         admin_response = {
             "text": (
                 "You can reach our customer service team directly through WhatsApp:\n\n"
@@ -1065,49 +1155,36 @@ def handle_faq(user: User, messenger_id: str, user_input: str):
         f"Remaining Tenure: {user.remaining_tenure or user.tenure or 0} years\n"
     )
 
-    try:
-        conversation = [
-            {
-                "role": "system",
-                "content": (
-                    "You are Finzo AI Buddy, an expert in refinancing and loan advisory. "
-                    "If users request to speak with a human, admin, or agent, always provide "
-                    "the WhatsApp contact link: https://wa.me/60126181683. "
-                    "For other questions, answer based on their previous calculations. "
-                    "Context:\n" + context
-                )
-            },
-            {
-                "role": "user",
-                "content": user_input
-            }
-        ]
-
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=conversation,
-            temperature=0.7,
-            max_tokens=300
-        )
-
-        reply = response.choices[0].message.content.strip()
-        send_messenger_message(messenger_id, {"text": reply})
-        logging.debug("FAQ response generated and sent to user.")
-
-    except Exception as e:
-        logging.error(f"Error handling FAQ: {e}")
-        error_message = {
-            "text": (
-                "I apologize for the technical difficulty. Please contact our admin "
-                "directly at https://wa.me/60126181683 for immediate assistance."
+    conversation = [
+        {
+            "role": "system",
+            "content": (
+                "You are Finzo AI Buddy, an expert in refinancing and loan advisory. "
+                "If users request to speak with a human, admin, or agent, always provide "
+                "the WhatsApp contact link: https://wa.me/60126181683. "
+                "For other questions, answer based on their previous calculations. "
+                "Context:\n" + context
             )
+        },
+        {
+            "role": "user",
+            "content": user_input
         }
-        send_messenger_message(messenger_id, error_message)
-        logging.debug("Error occurred while handling FAQ. Directed user to admin.")
+    ]
+
+    # Reply is generated and sent in the background
+    EXECUTOR.submit(
+        _do_gpt_reply, messenger_id, conversation, user.language,
+        max_tokens=300,
+        fallback_text=(
+            "I apologize for the technical difficulty. Please contact our admin "
+            "directly at https://wa.me/60126181683 for immediate assistance."
+        )
+    )
+    logging.debug("FAQ query queued for GPT reply.")
 
     # Update session state
     user.state = STATES['WAITING_INPUT']
-    db.session.commit()
 
     # Notify admin
     notify_admin(user, f"FAQ query received: {user_input}")
@@ -1118,9 +1195,8 @@ def notify_admin(user: User, event_name: str, summary: str = None):
     """
     Sends an admin notification with loan comparison details.
     """
-    admin_id = os.getenv("ADMIN_MESSENGER_ID")
-    if not admin_id or not admin_id.isdigit():
-        logging.warning(f"No valid ADMIN_MESSENGER_ID set. Skipping notify_admin.")
+    if not ADMIN_ENABLED:
+        logging.warning("No valid ADMIN_MESSENGER_ID set. Skipping notify_admin.")
         return
 
     if summary:
@@ -1141,7 +1217,7 @@ def notify_admin(user: User, event_name: str, summary: str = None):
             "No loan calculation details available yet."
         )
 
-    send_messenger_message(admin_id, {"text": comparison})
+    send_messenger_message(ADMIN_MESSENGER_ID, {"text": comparison})
     logging.debug("Admin notification sent.")
 
 # Unhandled State Handler
@@ -1157,78 +1233,12 @@ def handle_unhandled_state(user: User, messenger_id: str, user_input: str):
 
     # Optionally, reset the user state to a known state
     user.state = STATES['END']
-    db.session.commit()
 
 # Messaging Functions
 def send_initial_message(messenger_id):
-    message = {
-        "text": (
-            "👋 Welcome to *Finzo AI Assistant*!\n\n"
-            "• I’m here to help you explore refinancing options.\n"
-            "• We’ll work together to optimize your housing loans.\n"
-            "• My goal is to help you identify potential savings* and *improve financial efficiency*.\n\n"
-            "Are you ready to get started?"
-        ),
-        "quick_replies": [
-            {
-                "content_type": "text",
-                "title": "Yes, let's start!",
-                "payload": "GET_STARTED_YES"
-            },
-            {
-                "content_type": "text",
-                "title": "Contact Admin",
-                "payload": "CONTACT_ADMIN"
-            }
-        ]
-    }
-    send_messenger_message(messenger_id, message)
+    send_messenger_message(messenger_id, INITIAL_MESSAGE)
     logging.debug("Initial welcome message sent with default language set to English.")
 
-
-
-def send_messenger_message(recipient_id, message):
-    """
-    Sends a message to the user via Facebook Messenger API.
-
-    Parameters:
-    - recipient_id (str): The Facebook ID of the recipient.
-    - message (dict): The message payload containing 'text' and optionally 'quick_replies'.
-    """
-    try:
-        logging.debug(f"Recipient ID: {recipient_id}")
-        url = f"https://graph.facebook.com/v16.0/me/messages?access_token={os.getenv('PAGE_ACCESS_TOKEN')}"
-        headers = {"Content-Type": "application/json"}
-
-        # Validate message format
-        if isinstance(message, str):
-            # Simple text message
-            data = {
-                "recipient": {"id": recipient_id},
-                "message": {"text": message}
-            }
-        elif isinstance(message, dict):
-            # Message with quick replies or attachments
-            data = {
-                "recipient": {"id": recipient_id},
-                "message": message
-            }
-        else:
-            raise ValueError("Invalid message format!")
-
-        logging.debug(f"Sending payload: {json.dumps(data, indent=4)}")
-
-        # Send the request
-        resp = requests.post(url, json=data, headers=headers)
-        logging.debug(f"Response status: {resp.status_code}")
-        logging.debug(f"Response body: {resp.text}")
-        resp.raise_for_status()
-
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Failed to send message: {e}")
-    except ValueError as ve:
-        logging.error(f"Message formatting error: {ve}")
-
 STATE_HANDLERS = {
     STATES['GET_STARTED_YES']: handle_get_started_yes,  # New handler for getting started
     STATES['CONTACT_ADMIN']: handle_contact_admin,      # New handler for contacting admin
@@ -1262,100 +1272,173 @@ STATE_HANDLERS = {
     STATES['END']: handle_unhandled_state
 }
 
+def _create_missing_users(sender_ids):
+    """
+    Inserts a new-user row for each sender that has none and returns the ids actually created.
+    ON CONFLICT DO NOTHING lets concurrent deliveries from a first-time sender both get past this
+    step; only one of them creates (and welcomes) the user.
+    """
+    insert = _UPSERT_INSERTS[db.session.get_bind().dialect.name]
+    stmt = (
+        insert(User)
+        .values([
+            dict(
+                messenger_id=sender_id,
+                name="Unknown",
+                phone_number="Unknown",
+                language='en',  # Default to English
+                state=STATES['GET_STARTED_YES'],  # Start with name collection
+                last_interaction=datetime.utcnow()
+            )
+            for sender_id in sender_ids
+        ])
+        .on_conflict_do_nothing(index_elements=['messenger_id'])
+        .returning(User.messenger_id)
+    )
+    return set(db.session.execute(stmt).scalars())
+
+def _lock_users(sender_ids):
+    """
+    Makes sure every sender has a row, then loads and locks them with SELECT ... FOR UPDATE, so two
+    workers never handle the same sender at once: a second delivery waits for the first one's commit.
+    Returns the users by messenger_id and the ids created by this delivery.
+    Locks are released by the delivery's commit or rollback.
+    """
+    valid_ids = {sender_id for sender_id in sender_ids if sender_id.isdigit()}
+    if not valid_ids:
+        return {}, set()
+    created_ids = _create_missing_users(valid_ids)
+    query = select(User).where(User.messenger_id.in_(valid_ids)).with_for_update()
+    users = {user.messenger_id: user for user in db.session.execute(query).scalars()}
+    return users, created_ids
+
+def _process_messaging_events(app, messaging_events):
+    """
+    Runs on EXECUTOR: handles one sender's messaging events inside its own app context and DB session.
+    """
+    with app.app_context():
+        try:
+            _handle_messaging_events(messaging_events)
+        except Exception:
+            logging.exception("Error handling messaging events")
+
+def _handle_messaging_events(messaging_events):
+    """
+    Dispatches each messaging event to its state handler and commits the delivery once.
+    """
+    # Fetch and row-lock every sender in this delivery
+    sender_ids = {str(event['sender']['id']).strip() for event in messaging_events}
+    users, new_user_ids = _lock_users(sender_ids)
+    touched_users = {}  # Users whose last_interaction is refreshed at the end
+    now = datetime.utcnow()
+    idle_cutoff = now - timedelta(hours=24)  # Users last seen before this get a welcome back
+
+    for event in messaging_events:
+        sender_id = str(event['sender']['id']).strip()
+
+        # Check if it's a message event or postback event
+        if 'message' in event:
+            message = event['message']
+            # Check if the message contains a quick_reply
+            if 'quick_reply' in message:
+                user_input = message['quick_reply']['payload']
+                logging.debug("Received quick_reply payload: %s", user_input)
+            else:
+                user_input = message.get('text', '').strip()
+                logging.debug("Received text: %s", user_input)
+        elif 'postback' in event:
+            postback = event['postback']
+            user_input = postback.get('payload', '').strip()
+            logging.debug("Received postback payload: %s", user_input)
+
+        if not sender_id or not sender_id.isdigit():
+            logging.error("Invalid messenger ID.")
+            continue  # Skip to the next event
+
+        user = users[sender_id]
+        if sender_id in new_user_ids:
+            # First event from a user created by this delivery
+            new_user_ids.discard(sender_id)
+            send_initial_message(sender_id)
+            logging.debug("New user created and initial message sent.")
+            continue  # Move to the next event
+
+        # Check if the user has been idle for more than 24 hours
+        last_interaction = user.last_interaction
+        if last_interaction and last_interaction < idle_cutoff and sender_id not in touched_users:
+            # Send welcome back message if idle for more than 24 hours
+            send_welcome_back_message(sender_id)
+            logging.debug("User was idle for more than 24 hours. Sent welcome back message.")
+        
+        # Handle 'restart' command at any time
+        if user_input.lower() == 'restart':
+            reset_user(user)
+            send_initial_message(sender_id)
+            logging.debug("User initiated restart. State reset and initial message sent.")
+            continue  # Move to the next event
+
+        # Handle other specific payloads like "CONTACT_ADMIN" or "GET_STARTED_YES"
+        if user_input == "CONTACT_ADMIN":
+            handle_contact_admin(user, sender_id, user_input)
+            continue
+
+        if user_input == "GET_STARTED_YES":
+            handle_get_started_yes(user, sender_id, user_input)
+            continue
+
+        # Main Logic Flow
+        if not user.state:
+            user.state = STATES['GET_STARTED_YES']
+            logging.debug("User state was None. Set to GET_STARTED_YES.")
+        
+        # Call the appropriate state handler
+        state_handler = STATE_HANDLERS.get(user.state, handle_unhandled_state)
+        state_handler(user, sender_id, user_input)
+
+        # Last interaction timestamp is updated in bulk below
+        touched_users[sender_id] = user
+
+    # Persist all changes made while handling this webhook in one commit
+    try:
+        if touched_users:
+            db.session.flush()  # Assigns ids to users created in this delivery
+            db.session.bulk_update_mappings(
+                User, [{'id': user.id, 'last_interaction': now} for user in touched_users.values()]
+            )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logging.error("Error committing webhook changes: %s", e)
+        raise
+
 @chatbot_bp.route('/webhook', methods=['POST'])
 def process_message():
     try:
         data = request.get_json()
-        logging.debug(f"Received data: {data}")
+        logging.debug("Received data: %s", data)
 
-        messaging_events = data.get('entry', [])[0].get('messaging', [])
+        # Facebook may batch a burst across several entries, each with its own messaging array
+        messaging_events = [
+            event for entry in data.get('entry', []) for event in entry.get('messaging', [])
+        ]
         if not messaging_events:
             logging.debug("No messaging events found in the received data.")
             return jsonify({"status": "no messaging events"}), 200
 
+        # One task per sender on the worker pool: senders run concurrently (bounded by
+        # MESSAGE_CONCURRENCY), each sender's events stay in order, and Facebook gets its 200 right away
+        events_by_sender = defaultdict(list)
         for event in messaging_events:
-            sender_id = str(event['sender']['id']).strip()
-
-            # Check if it's a message event or postback event
-            if 'message' in event:
-                message = event['message']
-                # Check if the message contains a quick_reply
-                if 'quick_reply' in message:
-                    user_input = message['quick_reply']['payload']
-                    logging.debug(f"Received quick_reply payload: {user_input}")
-                else:
-                    user_input = message.get('text', '').strip()
-                    logging.debug(f"Received text: {user_input}")
-            elif 'postback' in event:
-                postback = event['postback']
-                user_input = postback.get('payload', '').strip()
-                logging.debug(f"Received postback payload: {user_input}")
-
-            if not sender_id or not sender_id.isdigit():
-                logging.error("Invalid messenger ID.")
-                continue  # Skip to the next event
-
-            # Check if user exists in the database
-            user = User.query.filter_by(messenger_id=sender_id).first()
-            if not user:
-                # Create new user with default state
-                user = User(
-                    messenger_id=sender_id,
-                    name="Unknown",
-                    phone_number="Unknown",
-                    language='en',  # Default to English
-                    state=STATES['GET_STARTED_YES']  # Start with name collection
-                )
-                db.session.add(user)
-                db.session.commit()
-
-                send_initial_message(sender_id)
-                logging.debug("New user created and initial message sent.")
-                continue  # Move to the next event
-
-            # Check if the user has been idle for more than 24 hours
-            last_interaction = user.last_interaction
-            if last_interaction:
-                time_diff = datetime.utcnow() - last_interaction
-                if time_diff > timedelta(hours=24):
-                    # Send welcome back message if idle for more than 24 hours
-                    send_welcome_back_message(sender_id)
-                    logging.debug("User was idle for more than 24 hours. Sent welcome back message.")
-            
-            # Handle 'restart' command at any time
-            if user_input.lower() == 'restart':
-                reset_user(user)
-                send_initial_message(sender_id)
-                logging.debug("User initiated restart. State reset and initial message sent.")
-                continue  # Move to the next event
-
-            # Handle other specific payloads like "CONTACT_ADMIN" or "GET_STARTED_YES"
-            if user_input == "CONTACT_ADMIN":
-                handle_contact_admin(user, sender_id, user_input)
-                continue
-
-            if user_input == "GET_STARTED_YES":
-                handle_get_started_yes(user, sender_id, user_input)
-                continue
-
-            # Main Logic Flow
-            if not user.state:
-                user.state = STATES['GET_STARTED_YES']
-                db.session.commit()
-                logging.debug("User state was None. Set to GET_STARTED_YES.")
-            
-            # Call the appropriate state handler
-            state_handler = STATE_HANDLERS.get(user.state, handle_unhandled_state)
-            state_handler(user, sender_id, user_input)
-
-            # Update last interaction timestamp
-            user.last_interaction = datetime.utcnow()
-            db.session.commit()
+            events_by_sender[str(event.get('sender', {}).get('id', '')).strip()].append(event)
+
+        app = current_app._get_current_object()
+        for sender_events in events_by_sender.values():
+            EXECUTOR.submit(_process_messaging_events, app, sender_events)
 
         return jsonify({"status": "success"}), 200
 
-    except Exception as e:
-        logging.error(f"Error in process_message: {e}")
+    except Exception:
+        logging.exception("Error in process_message")
         return jsonify({"status": "error", "message": "Internal server error"}), 500
     
 def check_user_idle(user):
@@ -1368,13 +1451,7 @@ def check_user_idle(user):
     return False
 
 def send_welcome_back_message(messenger_id):
-    message = {
-        "text": (
-            "Hi, welcome back! 👋\n\n"
-            "If you need to calculate again, please type 'restart'."
-        )
-    }
-    send_messenger_message(messenger_id, message)
+    send_messenger_message(messenger_id, WELCOME_BACK_MESSAGE)
     logging.debug("Sent 'Welcome back' message to user.")
 
 def reset_user(user: User):
@@ -1399,6 +1476,5 @@ def reset_user(user: User):
     user.total_savings = None
     user.tenure = None
     user.new_rate = None
-    db.session.commit()
     logging.debug("User data reset to initial state with default language set to English.")
 
@@ -1,10 +1,71 @@
 # backend/utils/calculation.py
 
 import logging
-import traceback
 import math
+import time
+import threading
+from bisect import bisect_right
+from sqlalchemy import select
+from backend.extensions import db
 from backend.models import BankRate
 
+# In-process copy of the BankRate table, published as one (rows, mins, loaded_at) tuple so readers
+# never see rows and mins from different loads. Rows are (min_amount, max_amount, interest_rate,
+# bank_name) sorted by min_amount; mins holds their min_amounts. Loaded lazily and reloaded once it
+# is BANK_RATE_CACHE_TTL seconds old, so rate edits made directly in the database reach every worker.
+BANK_RATE_CACHE_TTL = 300
+_BANK_RATE_CACHE = None
+_BANK_RATE_LOCK = threading.Lock()
+
+def _bank_rate_cache_fresh(cache):
+    return cache is not None and time.monotonic() - cache[2] < BANK_RATE_CACHE_TTL
+
+def _load_bank_rate_cache():
+    """
+    Load all bank rates into memory, sorted by min_amount; returns the (rows, mins, loaded_at) cache.
+    An empty table is not cached, so the next lookup tries again (e.g. once bank_rates is seeded).
+    """
+    global _BANK_RATE_CACHE
+    with _BANK_RATE_LOCK:
+        if _bank_rate_cache_fresh(_BANK_RATE_CACHE):
+            return _BANK_RATE_CACHE
+        # Plain column rows, no ORM objects; the range index serves the ORDER BY
+        rows = tuple(tuple(row) for row in db.session.execute(
+            select(BankRate.min_amount, BankRate.max_amount, BankRate.interest_rate, BankRate.bank_name)
+            .order_by(BankRate.min_amount, BankRate.max_amount, BankRate.interest_rate)
+        ))
+        cache = (rows, tuple(row[0] for row in rows), time.monotonic())
+        if rows:
+            _BANK_RATE_CACHE = cache
+            logging.debug("🏦 Loaded %s bank rates into cache.", len(rows))
+        else:
+            logging.warning("⚠️ No bank rates found; not caching.")
+        return cache
+
+def invalidate_bank_rate_cache():
+    """Drop the cached bank rates so the next lookup reloads them (call after updating BankRate rows)."""
+    global _BANK_RATE_CACHE
+    with _BANK_RATE_LOCK:
+        _BANK_RATE_CACHE = None
+
+def find_best_bank_rate(loan_amount):
+    """
+    Return the cached (min_amount, max_amount, interest_rate, bank_name) tier with the
+    lowest interest rate covering loan_amount, or None if no tier matches.
+    A max_amount of None is treated as unbounded.
+    """
+    cache = _BANK_RATE_CACHE
+    if not _bank_rate_cache_fresh(cache):
+        cache = _load_bank_rate_cache()
+    rows, mins, _ = cache
+
+    best = None
+    # Only tiers with min_amount <= loan_amount can match
+    for row in rows[:bisect_right(mins, loan_amount)]:
+        if (row[1] is None or row[1] >= loan_amount) and (best is None or row[2] < best[2]):
+            best = row
+    return best
+
 def calculate_refinance_savings(original_loan_amount, original_loan_tenure, current_repayment):
     """
     Calculate potential refinance savings using the provided inputs.
@@ -35,16 +96,13 @@ def calculate_refinance_savings(original_loan_amount, original_loan_tenure, curr
             return result
 
         # Query the best bank rate based on the original loan amount
-        bank_rate = BankRate.query.filter(
-            BankRate.min_amount <= original_loan_amount,
-            BankRate.max_amount >= original_loan_amount
-        ).order_by(BankRate.interest_rate).first()
+        bank_rate = find_best_bank_rate(original_loan_amount)
 
         if bank_rate:
-            result['new_interest_rate'] = bank_rate.interest_rate
-            result['bank_name'] = bank_rate.bank_name
+            result['new_interest_rate'] = bank_rate[2]
+            result['bank_name'] = bank_rate[3]
         else:
-            logging.error(f"❌ No bank rate found for loan amount: {original_loan_amount}")
+            logging.error("❌ No bank rate found for loan amount: %s", original_loan_amount)
             return result
 
         # Calculate new monthly repayment
@@ -54,10 +112,16 @@ def calculate_refinance_savings(original_loan_amount, original_loan_tenure, curr
         if monthly_interest_rate == 0:
             new_monthly_repayment = original_loan_amount / total_payments
         else:
-            new_monthly_repayment = original_loan_amount * (monthly_interest_rate * (1 + monthly_interest_rate) ** total_payments) / ((1 + monthly_interest_rate) ** total_payments - 1)
+            growth = (1 + monthly_interest_rate) ** total_payments  # Compound factor, computed once
+            new_monthly_repayment = original_loan_amount * monthly_interest_rate * growth / (growth - 1)
 
         result['new_monthly_repayment'] = round(new_monthly_repayment, 2)
 
+        # No savings: leave the savings fields at zero
+        if current_repayment <= result['new_monthly_repayment']:
+            logging.debug("No savings: current repayment %s <= new repayment %s", current_repayment, result['new_monthly_repayment'])
+            return result
+
         # Calculate savings
         monthly_savings = current_repayment - result['new_monthly_repayment']
         yearly_savings = monthly_savings * 12
@@ -68,20 +132,11 @@ def calculate_refinance_savings(original_loan_amount, original_loan_tenure, curr
         result['lifetime_savings'] = round(lifetime_savings, 2)
 
         # Calculate years and months saved
-        if lifetime_savings > 0 and current_repayment > 0:
-            total_months_saved = lifetime_savings / current_repayment
-            years_saved = total_months_saved // 12
-            months_saved = total_months_saved % 12
-
-            if months_saved == 12:  # Edge case where months_saved == 12
-                years_saved += 1
-                months_saved = 0
-
-            result['years_saved'] = years_saved
-            result['months_saved'] = months_saved
+        total_months_saved = round(lifetime_savings / current_repayment)
+        result['years_saved'], result['months_saved'] = divmod(total_months_saved, 12)
 
         return result
 
-    except Exception as e:
-        logging.error(f"❌ Error calculating refinance savings: {e}")
+    except Exception:
+        logging.exception("❌ Error calculating refinance savings")
         return result  # Return the default result in case of error
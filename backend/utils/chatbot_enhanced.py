@@ -1,176 +1,402 @@
 import re
 import random
+import asyncio
 import logging
-import json
 import os
+import math
+import operator
+import threading
+import weakref
+from collections import deque, OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
 from datetime import datetime
-from difflib import get_close_matches
+import msgspec
 import openai
+from rapidfuzz import fuzz, process
+from backend.utils.rate_limit import OPENAI_LIMITER, estimate_tokens
+
+# Characters stripped from queries and FAQ keys before matching
+_PUNCT_RE = re.compile(r'[^\w\s]')
+# The ASCII characters _PUNCT_RE removes, for the bytes.translate fast path
+_ASCII_PUNCT = bytes(c for c in range(128) if _PUNCT_RE.match(chr(c)))
+
+def _strip_punct(text):
+    """Remove punctuation; ASCII text (most messages) skips the regex engine."""
+    if text.isascii():
+        return text.encode('ascii').translate(None, _ASCII_PUNCT).decode('ascii')
+    return _PUNCT_RE.sub('', text)
+
+GREETINGS = ('hi', 'hello', 'hey', 'good morning', 'good afternoon', 'good evening')
+CONTACT_PHRASES = (
+    "talk to", "contact", "need help", "speak to", "how do i talk",
+    "how to talk", "can i talk", "can i contact", "connect me",
+    "transfer", "reach out"
+)
+# Whole words (after punctuation is stripped) that make a contact phrase a request for a person
+_CONTACT_TOKENS = frozenset({"agent", "agents", "human", "humans", "admin", "admins", "team", "your"})
+
+def _phrase_re(phrases):
+    """Compile phrases into one alternation regex (longest first, so overlapping phrases still match)."""
+    return re.compile('|'.join(map(re.escape, sorted(phrases, key=len, reverse=True))))
+
+# Single intent matcher: one scan of the casefolded message tags greeting (start only) and contact phrase hits
+_INTENT_RE = re.compile(
+    r'(?P<greeting>^(?:' + _phrase_re(GREETINGS).pattern + r'))'
+    r'|(?P<contact>' + _phrase_re(CONTACT_PHRASES).pattern + r')'
+)
+
+GPT_SYSTEM_PROMPT = (
+    "You are Finzo AI Buddy, a friendly Malaysian financial assistant specializing in home loans "
+    "and refinancing. Keep responses concise, helpful, and natural. Focus on providing accurate "
+    "information about home loans, refinancing, and related financial topics in Malaysia."
+)
+
+# Canned replies per language, shared by every ChatbotHandler
+TRANSLATIONS = {
+    'en': {
+        'greetings': [
+            "Hey there! 👋 How can I help you with your financial needs today?",
+            "Hello! 😊 Ready to explore your loan options?",
+            "Hi! I'm here to help with all your refinancing questions!",
+            "Welcome! How can I assist you with your home loan today?"
+        ],
+        'contact_response': "I'll connect you with our team right away: https://wa.me/60126181683",
+        'error_message': "I'm having a moment. Please reach out to our team: https://wa.me/60126181683",
+        'dynamic_responses': {
+            'refinancing': "Refinancing means replacing your current loan with a new one to get better rates or lower payments. Would you like to know more about the benefits?",
+            'interest_rate': "Our interest rates are competitive and vary based on your loan amount and tenure. Would you like to get a personalized quote?",
+            'documents': "For refinancing, you'll typically need your existing loan details, income documents, and property information. Want me to explain more?",
+            'eligibility': "Loan eligibility depends on factors like income, credit score, and existing commitments. Shall I connect you with our expert for a detailed assessment?"
+        }
+    },
+    'ms': {
+        'greetings': [
+            "Hai! 👋 Bagaimana saya boleh bantu keperluan kewangan anda hari ini?",
+            "Hello! 😊 Bersedia untuk meneroka pilihan pinjaman anda?",
+            "Hi! Saya di sini untuk membantu semua soalan pembiayaan semula anda!",
+            "Selamat datang! Bagaimana saya boleh bantu dengan pinjaman rumah anda hari ini?"
+        ],
+        'contact_response': "Saya akan hubungkan anda dengan pasukan kami sekarang: https://wa.me/60126181683",
+        'error_message': "Saya menghadapi masalah. Sila hubungi pasukan kami: https://wa.me/60126181683",
+        'dynamic_responses': {
+            'refinancing': "Pembiayaan semula bermaksud menggantikan pinjaman semasa anda dengan yang baru untuk mendapatkan kadar atau bayaran yang lebih baik. Mahu tahu lebih lanjut tentang manfaatnya?",
+            'interest_rate': "Kadar faedah kami kompetitif dan berbeza berdasarkan jumlah dan tempoh pinjaman anda. Mahukah anda mendapatkan sebut harga peribadi?",
+            'documents': "Untuk pembiayaan semula, anda biasanya memerlukan butiran pinjaman sedia ada, dokumen pendapatan, dan maklumat harta. Mahu saya terangkan lebih lanjut?",
+            'eligibility': "Kelayakan pinjaman bergantung pada faktor seperti pendapatan, skor kredit, dan komitmen sedia ada. Boleh saya hubungkan anda dengan pakar kami untuk penilaian terperinci?"
+        }
+    }
+}
+
+# Dynamic-response keyword matcher per language
+_DYNAMIC_KEY_RES = {
+    language_code: _phrase_re(strings['dynamic_responses'])
+    for language_code, strings in TRANSLATIONS.items()
+}
+
+# FAQ section of presets.json, parsed once at import
+PRESETS_FILE = os.path.join(os.path.dirname(__file__), 'presets.json')
+try:
+    with open(PRESETS_FILE, 'rb') as file:
+        FAQ_DATA = msgspec.json.decode(file.read()).get('faq', {})
+except Exception as e:
+    logging.error(f"Error loading FAQ data: {str(e)}")
+    FAQ_DATA = {}
+
+# Concurrent OpenAI calls allowed on the async path
+GPT_CONCURRENCY = int(os.getenv('GPT_CONCURRENCY', '10'))
+# One semaphore per event loop: a semaphore binds to the first loop that waits on it
+_GPT_SEMAPHORES = weakref.WeakKeyDictionary()
+
+def _gpt_semaphore():
+    """The GPT_CONCURRENCY semaphore for the running event loop."""
+    loop = asyncio.get_running_loop()
+    semaphore = _GPT_SEMAPHORES.get(loop)
+    if semaphore is None:
+        semaphore = _GPT_SEMAPHORES[loop] = asyncio.Semaphore(GPT_CONCURRENCY)
+    return semaphore
+
+def _gpt_request(question):
+    """ChatCompletion arguments for answering the user's question as they wrote it."""
+    return dict(
+        model="gpt-3.5-turbo",
+        messages=[
+            {"role": "system", "content": GPT_SYSTEM_PROMPT},
+            {"role": "user", "content": question}
+        ],
+        temperature=0.7,
+        max_tokens=150
+    )
+
+# GPT answers keyed by normalized question, least recently used evicted first
+GPT_CACHE_SIZE = 512
+_GPT_ANSWERS = OrderedDict()
+_GPT_ANSWERS_LOCK = threading.Lock()
+
+def _cached_gpt_answer(normalized_question, question):
+    """
+    Ask GPT once per normalized question; repeats are served from the cache. Failures are not cached.
+    The normalized form is only the cache key, GPT sees the original question.
+    """
+    with _GPT_ANSWERS_LOCK:
+        if normalized_question in _GPT_ANSWERS:
+            _GPT_ANSWERS.move_to_end(normalized_question)
+            return _GPT_ANSWERS[normalized_question]
+    request = _gpt_request(question)
+    OPENAI_LIMITER.acquire(estimate_tokens(request['messages'], request['max_tokens']))
+    response = openai.ChatCompletion.create(**request)
+    answer = response['choices'][0]['message']['content'].strip()
+    with _GPT_ANSWERS_LOCK:
+        _GPT_ANSWERS[normalized_question] = answer
+        if len(_GPT_ANSWERS) > GPT_CACHE_SIZE:
+            _GPT_ANSWERS.popitem(last=False)
+    return answer
+
+async def _agpt_answer(question):
+    """Ask GPT without blocking the event loop, at most GPT_CONCURRENCY calls at a time."""
+    request = _gpt_request(question)
+    async with _gpt_semaphore():
+        await OPENAI_LIMITER.acquire_async(estimate_tokens(request['messages'], request['max_tokens']))
+        response = await openai.ChatCompletion.acreate(**request)
+    return response['choices'][0]['message']['content'].strip()
+
+# Semantic answer cache: reuse a GPT answer for questions whose embeddings are this similar
+EMBEDDING_MODEL = "text-embedding-3-small"
+SEMANTIC_CACHE_SIZE = int(os.getenv('SEMANTIC_CACHE_SIZE', '256'))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.93'))
+
+@lru_cache(maxsize=1024)
+def _embed(normalized_question):
+    """Unit-length embedding of a normalized question, so cosine similarity is a plain dot product."""
+    OPENAI_LIMITER.acquire(len(normalized_question) // 4 + 1)
+    response = openai.Embedding.create(model=EMBEDDING_MODEL, input=normalized_question)
+    vector = response['data'][0]['embedding']
+    norm = math.sqrt(sum(map(operator.mul, vector, vector))) or 1.0
+    return tuple(x / norm for x in vector)
+
+class _SemanticCache:
+    """
+    Bounded FIFO of (embedding, answer) pairs searched by cosine similarity.
+    The scan is pure Python: about 12-15 ms per lookup when full (256 x 1536), so keep it off the event loop.
+    """
+
+    def __init__(self, maxsize, threshold):
+        self.threshold = threshold
+        self._entries = deque(maxlen=maxsize)
+        self._lock = threading.Lock()
+
+    def get(self, vector):
+        """Answer of the most similar cached question, if it clears the threshold."""
+        with self._lock:
+            entries = list(self._entries)
+        best_score, best_answer = self.threshold, None
+        for cached, answer in entries:
+            score = sum(map(operator.mul, cached, vector))
+            if score >= best_score:
+                best_score, best_answer = score, answer
+        return best_answer
+
+    def put(self, vector, answer):
+        with self._lock:
+            self._entries.append((vector, answer))
+
+_SEMANTIC_CACHE = _SemanticCache(SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_THRESHOLD)
+
+def _semantic_gpt_answer(normalized_question, question):
+    """GPT answer, reused from a similar earlier question when possible. Embedding failures fall back to GPT."""
+    try:
+        vector = _embed(normalized_question)
+    except Exception as e:
+        logging.warning(f"⚠️ Embedding failed, skipping semantic cache: {str(e)}")
+        return _cached_gpt_answer(normalized_question, question)
+    answer = _SEMANTIC_CACHE.get(vector)
+    if answer is None:
+        answer = _cached_gpt_answer(normalized_question, question)
+        _SEMANTIC_CACHE.put(vector, answer)
+    return answer
+
+def _embed_and_lookup(normalized_question):
+    """Embedding of the question and the semantically cached answer for it, if any."""
+    vector = _embed(normalized_question)
+    return vector, _SEMANTIC_CACHE.get(vector)
+
+async def _asemantic_gpt_answer(normalized_question, question):
+    """Async counterpart of _semantic_gpt_answer; the embedding call and cache scan run in a worker thread."""
+    try:
+        vector, answer = await asyncio.to_thread(_embed_and_lookup, normalized_question)
+    except Exception as e:
+        logging.warning(f"⚠️ Embedding failed, skipping semantic cache: {str(e)}")
+        return await _agpt_answer(question)
+    if answer is None:
+        answer = await _agpt_answer(question)
+        _SEMANTIC_CACHE.put(vector, answer)
+    return answer
+
+@dataclass(slots=True)
+class QueryCtx:
+    """A user question preprocessed once and shared by every matching stage."""
+    raw: str
+    lower: str  # casefolded raw text
+    normalized: str  # casefolded, punctuation stripped, whitespace collapsed
+    tokens: frozenset  # words of normalized
+    intents: frozenset  # 'greeting' / 'contact' tags from _INTENT_RE
 
 class ChatbotHandler:
     def __init__(self):
-        self.faq_data = self._load_faq_data()
-        self.translations = {
-            'en': {
-                'greetings': [
-                    "Hey there! 👋 How can I help you with your financial needs today?",
-                    "Hello! 😊 Ready to explore your loan options?",
-                    "Hi! I'm here to help with all your refinancing questions!",
-                    "Welcome! How can I assist you with your home loan today?"
-                ],
-                'contact_response': "I'll connect you with our team right away: https://wa.me/60126181683",
-                'error_message': "I'm having a moment. Please reach out to our team: https://wa.me/60126181683",
-                'dynamic_responses': {
-                    'refinancing': "Refinancing means replacing your current loan with a new one to get better rates or lower payments. Would you like to know more about the benefits?",
-                    'interest_rate': "Our interest rates are competitive and vary based on your loan amount and tenure. Would you like to get a personalized quote?",
-                    'documents': "For refinancing, you'll typically need your existing loan details, income documents, and property information. Want me to explain more?",
-                    'eligibility': "Loan eligibility depends on factors like income, credit score, and existing commitments. Shall I connect you with our expert for a detailed assessment?"
-                }
-            },
-            'ms': {
-                'greetings': [
-                    "Hai! 👋 Bagaimana saya boleh bantu keperluan kewangan anda hari ini?",
-                    "Hello! 😊 Bersedia untuk meneroka pilihan pinjaman anda?",
-                    "Hi! Saya di sini untuk membantu semua soalan pembiayaan semula anda!",
-                    "Selamat datang! Bagaimana saya boleh bantu dengan pinjaman rumah anda hari ini?"
-                ],
-                'contact_response': "Saya akan hubungkan anda dengan pasukan kami sekarang: https://wa.me/60126181683",
-                'error_message': "Saya menghadapi masalah. Sila hubungi pasukan kami: https://wa.me/60126181683",
-                'dynamic_responses': {
-                    'refinancing': "Pembiayaan semula bermaksud menggantikan pinjaman semasa anda dengan yang baru untuk mendapatkan kadar atau bayaran yang lebih baik. Mahu tahu lebih lanjut tentang manfaatnya?",
-                    'interest_rate': "Kadar faedah kami kompetitif dan berbeza berdasarkan jumlah dan tempoh pinjaman anda. Mahukah anda mendapatkan sebut harga peribadi?",
-                    'documents': "Untuk pembiayaan semula, anda biasanya memerlukan butiran pinjaman sedia ada, dokumen pendapatan, dan maklumat harta. Mahu saya terangkan lebih lanjut?",
-                    'eligibility': "Kelayakan pinjaman bergantung pada faktor seperti pendapatan, skor kredit, dan komitmen sedia ada. Boleh saya hubungkan anda dengan pakar kami untuk penilaian terperinci?"
-                }
-            }
-        }
+        self.faq_data = FAQ_DATA
+        self._build_faq_index()
+        self.translations = TRANSLATIONS
 
-    def _load_faq_data(self):
-        """Load FAQ data from presets.json in utils folder."""
-        try:
-            preset_path = os.path.join(os.path.dirname(__file__), 'presets.json')
-            with open(preset_path, 'r') as file:
-                presets_data = json.load(file)
-            return presets_data.get('faq', {})
-        except Exception as e:
-            logging.error(f"Error loading FAQ data: {str(e)}")
-            return {}
+    def _build_faq_index(self):
+        """
+        Precompute per-language parallel tuples of normalized FAQ keys and their answers
+        (index i of one matches index i of the other), plus a normalized-key -> answer dict for exact hits.
+        """
+        self._faq_norm_keys = {}
+        self._faq_answers = {}
+        self._faq_answer_by_norm = {}
+        for language_code, faq_responses in self.faq_data.items():
+            answer_by_norm = {}
+            for key, answer in faq_responses.items():
+                answer_by_norm.setdefault(self._preprocess_query(key), answer)
+            self._faq_answer_by_norm[language_code] = answer_by_norm
+            self._faq_norm_keys[language_code] = tuple(answer_by_norm)
+            self._faq_answers[language_code] = tuple(answer_by_norm.values())
+        # Fresh answer cache for this index; hit/miss counters via self._faq_lookup.cache_info()
+        self._faq_lookup = lru_cache(maxsize=4096)(self._match_faq)
 
     def _get_language(self, user_data):
         """Get user's language code, default to English."""
         return getattr(user_data, 'language_code', 'en')
 
-    def _is_greeting(self, text):
-        """Check if the message is a greeting."""
-        greetings = ['hi', 'hello', 'hey', 'good morning', 'good afternoon', 'good evening']
-        return any(text.lower().startswith(g) for g in greetings)
+    def _build_ctx(self, question):
+        """Lowercase, normalize and tag the question once for all stages."""
+        lower = question.casefold()
+        words = _strip_punct(lower).split()
+        return QueryCtx(
+            raw=question,
+            lower=lower,
+            normalized=' '.join(words),
+            tokens=frozenset(words),
+            intents=frozenset(match.lastgroup for match in _INTENT_RE.finditer(lower))
+        )
+
+    def _is_greeting(self, ctx):
+        """Check if the message starts with a greeting."""
+        return 'greeting' in ctx.intents
 
     def _generate_greeting(self, language_code):
         """Generate greeting in user's language."""
         greetings = self.translations[language_code]['greetings']
         return random.choice(greetings)
 
-    def _handle_contact_queries(self, question, language_code):
-        contact_phrases = [
-        "talk to", "contact", "need help", "speak to", "how do i talk",
-        "how to talk", "can i talk", "can i contact", "connect me",
-        "transfer", "reach out"
-    ]
-    
-        question_lower = question.lower()
-        if any(phrase in question_lower for phrase in contact_phrases) and \
-       any(word in question_lower for word in ["agent", "human", "admin", "team", "your"]):
+    def _handle_contact_queries(self, ctx, language_code):
+        if 'contact' in ctx.intents and not _CONTACT_TOKENS.isdisjoint(ctx.tokens):
             return self.translations[language_code]['contact_response']
         return None
 
-    def _handle_faq_queries(self, question, user_data):
+    def _match_faq(self, language_code, normalized_question):
+        """Return the FAQ answer for a normalized question (exact key, then fuzzy), or None."""
+        answer = self._faq_answer_by_norm.get(language_code, {}).get(normalized_question)
+        if answer is not None:
+            return answer
+
+        match = process.extractOne(
+            normalized_question, self._faq_norm_keys.get(language_code, ()),
+            scorer=fuzz.ratio, score_cutoff=70
+        )
+        if match:
+            return self._faq_answers[language_code][match[2]]  # match is (key, score, index)
+
+        return None
+
+    def _handle_faq_queries(self, ctx, user_data):
         """Handle FAQ matching with presets."""
         try:
             language_code = getattr(user_data, 'language_code', 'en')
-            faq_responses = self.faq_data.get(language_code, {})
-            
-            normalized_question = self._preprocess_query(question)
-            
-            if normalized_question in faq_responses:
-                return faq_responses[normalized_question]
-            
-            matches = get_close_matches(normalized_question, faq_responses.keys(), n=1, cutoff=0.7)
-            if matches:
-                return faq_responses[matches[0]]
-            
-            return None
+            return self._faq_lookup(language_code, ctx.normalized)
             
         except Exception as e:
             logging.error(f"Error in FAQ queries: {str(e)}")
             return None
 
-    def _handle_dynamic_query(self, question, language_code):
+    def _handle_dynamic_query(self, ctx, language_code):
         """Handle dynamic responses in user's language."""
         try:
-            dynamic_responses = self.translations[language_code]['dynamic_responses']
-            question_lower = question.lower()
-            
-            for key, response in dynamic_responses.items():
-                if key in question_lower:
-                    return response
+            match = _DYNAMIC_KEY_RES[language_code].search(ctx.lower)
+            if match:
+                return self.translations[language_code]['dynamic_responses'][match.group()]
             return None
             
         except Exception as e:
             logging.error(f"Error in dynamic query: {str(e)}")
             return None
 
-    def _handle_gpt_query(self, question, language_code):
+    def _handle_gpt_query(self, ctx, language_code):
         """Handle queries using GPT."""
         try:
-            system_prompt = (
-                "You are Finzo AI Buddy, a friendly Malaysian financial assistant specializing in home loans "
-                "and refinancing. Keep responses concise, helpful, and natural. Focus on providing accurate "
-                "information about home loans, refinancing, and related financial topics in Malaysia."
-            )
-            
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": question}
-                ],
-                temperature=0.7,
-                max_tokens=150
-            )
-            
-            return response['choices'][0]['message']['content'].strip()
-            
+            return _semantic_gpt_answer(ctx.normalized, ctx.raw)
+        except Exception as e:
+            logging.error(f"GPT Query Failed: {str(e)}")
+            return self.translations[language_code]['error_message']
+
+    async def _ahandle_gpt_query(self, ctx, language_code):
+        """Handle queries using GPT on the running event loop."""
+        try:
+            return await _asemantic_gpt_answer(ctx.normalized, ctx.raw)
         except Exception as e:
             logging.error(f"GPT Query Failed: {str(e)}")
             return self.translations[language_code]['error_message']
 
     def _preprocess_query(self, text):
         """Preprocess user query for better matching."""
-        text = re.sub(r'[^\w\s]', '', text.lower())
+        text = _strip_punct(text.casefold())
         return ' '.join(text.split())
 
+    def _handle_canned_query(self, ctx, user_data, language_code):
+        """Greeting, contact, FAQ and dynamic replies; None when the question needs GPT."""
+        if self._is_greeting(ctx):
+            return self._generate_greeting(language_code)
+
+        contact_response = self._handle_contact_queries(ctx, language_code)
+        if contact_response:
+            return contact_response
+
+        faq_response = self._handle_faq_queries(ctx, user_data)
+        if faq_response:
+            return faq_response
+
+        return self._handle_dynamic_query(ctx, language_code)
+
     def handle_query(self, question, user_data, messenger_id):
         """Main entry point with language support."""
         try:
             language_code = self._get_language(user_data)
-            
-            if self._is_greeting(question):
-                return self._generate_greeting(language_code)
-
-            contact_response = self._handle_contact_queries(question, language_code)
-            if contact_response:
-                return contact_response
-
-            faq_response = self._handle_faq_queries(question, user_data)
-            if faq_response:
-                return faq_response
+            ctx = self._build_ctx(question)
+            return (
+                self._handle_canned_query(ctx, user_data, language_code)
+                or self._handle_gpt_query(ctx, language_code)
+            )
 
-            dynamic_response = self._handle_dynamic_query(question, language_code)
-            if dynamic_response:
-                return dynamic_response
+        except Exception as e:
+            logging.error(f"Error in handle_query: {str(e)}")
+            return self.translations[self._get_language(user_data)]['error_message']
 
-            return self._handle_gpt_query(question, language_code)
+    async def ahandle_query(self, question, user_data, messenger_id):
+        """Async entry point: same as handle_query, but the GPT fallback does not block the event loop."""
+        try:
+            language_code = self._get_language(user_data)
+            ctx = self._build_ctx(question)
+            return (
+                self._handle_canned_query(ctx, user_data, language_code)
+                or await self._ahandle_gpt_query(ctx, language_code)
+            )
 
         except Exception as e:
             logging.error(f"Error in handle_query: {str(e)}")
-            return self.translations[self._get_language(user_data)]['error_message']
\ No newline at end of file
+            return self.translations[self._get_language(user_data)]['error_message']
+
+
+# Shared handler: import this instead of constructing ChatbotHandler per request,
+# so the FAQ index and answer cache are built once per process.
+chatbot = ChatbotHandler()
@@ -1,39 +1,135 @@
 import os
-import requests
+import json
+import asyncio
 import logging
+import weakref
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from backend.utils.rate_limit import RateLimiter
+
+# Messenger settings, read once at import
+PAGE_ACCESS_TOKEN = os.getenv("PAGE_ACCESS_TOKEN")
+MESSENGER_URL = f"https://graph.facebook.com/v16.0/me/messages?access_token={PAGE_ACCESS_TOKEN}"
+
+# Shared HTTP session so Graph API calls reuse pooled keep-alive connections.
+# Retries are limited to failed connects and 429/503 responses: in both cases Facebook did not
+# accept the send. Read errors and timeouts are not retried, since the message may already be delivered.
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=64,
+    max_retries=Retry(
+        total=3,
+        read=0,
+        other=0,
+        backoff_factor=0.3,
+        status_forcelist=(429, 503),
+        allowed_methods=frozenset({"POST"}),
+        raise_on_status=False
+    )
+))
 
-# Load required environment variables
-FACEBOOK_API_URL = "https://graph.facebook.com/v21.0/me/messages"
-FACEBOOK_API_TOKEN = os.getenv("PAGE_ACCESS_TOKEN")  # Correct Token Variable
+# Send API calls per minute allowed from this process (messages and sender actions alike)
+MESSENGER_LIMITER = RateLimiter(int(os.getenv("MESSENGER_RPM", "12000")))
 
-def send_messenger_message(recipient_id, text):
-    """Send a text message using the Facebook Messenger API."""
-    # Construct API endpoint with Access Token in URL
-    url = f"{FACEBOOK_API_URL}?access_token={FACEBOOK_API_TOKEN}"
-    headers = {
-        "Content-Type": "application/json"
-    }
+# Shared aiohttp sessions for async senders, one per event loop, created lazily
+_aio_sessions = weakref.WeakKeyDictionary()
 
-    # Ensure recipient_id is string-encoded
-    recipient_id = str(recipient_id)
+def _build_payload(recipient_id, message):
+    """Wrap a str or message dict into a Send API payload; raises ValueError for anything else."""
+    # Validate message format
+    if isinstance(message, str):
+        # Simple text message
+        data = {
+            "recipient": {"id": recipient_id},
+            "message": {"text": message}
+        }
+    elif isinstance(message, dict):
+        # Message with quick replies or attachments
+        data = {
+            "recipient": {"id": recipient_id},
+            "message": message
+        }
+    else:
+        raise ValueError("Invalid message format!")
 
-    # Create JSON payload
-    payload = {
-        "recipient": {"id": recipient_id},
-        "message": {"text": text}
-    }
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug("Sending payload: %s", json.dumps(data))
+    return data
 
+def send_messenger_message(recipient_id, message):
+    """
+    Sends a message to the user via Facebook Messenger API.
+
+    Parameters:
+    - recipient_id (str): The Facebook ID of the recipient.
+    - message (str or dict): Plain text, or a message payload containing 'text' and optionally 'quick_replies'.
+    """
     try:
-        # Send POST request
-        response = requests.post(url, json=payload, headers=headers)
-        response.raise_for_status()  # Raise exception for HTTP errors
-        
-        # Log success
-        logging.info(f"✅ Message sent to {recipient_id}: {text}")
-        logging.info(f"Response: {response.json()}")  # Log API response for debugging
+        logging.debug("Recipient ID: %s", recipient_id)
+        headers = {"Content-Type": "application/json"}
+
+        data = _build_payload(recipient_id, message)
+
+        # Send the request (connect, read timeouts)
+        MESSENGER_LIMITER.acquire()
+        resp = SESSION.post(MESSENGER_URL, json=data, headers=headers, timeout=(3, 10))
+        logging.debug("Response status: %s", resp.status_code)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("Response body: %s", resp.text)
+        resp.raise_for_status()
+
+    except requests.exceptions.RequestException as e:
+        logging.error("Failed to send message: %s", e)
+    except ValueError as ve:
+        logging.error("Message formatting error: %s", ve)
 
+def send_sender_action(recipient_id, action="typing_on"):
+    """Sends a sender action ('typing_on', 'typing_off' or 'mark_seen') to the user."""
+    try:
+        data = {"recipient": {"id": recipient_id}, "sender_action": action}
+        MESSENGER_LIMITER.acquire()
+        resp = SESSION.post(MESSENGER_URL, json=data, timeout=(3, 10))
+        resp.raise_for_status()
     except requests.exceptions.RequestException as e:
-        # Capture errors
-        logging.error(f"❌ Failed to send message: {e}")
-        if response is not None:  # Log the response content for debugging
-            logging.error(f"Response: {response.text}")
+        logging.error("Failed to send sender action: %s", e)
+
+async def _get_aio_session():
+    loop = asyncio.get_running_loop()
+    session = _aio_sessions.get(loop)
+    if session is None or session.closed:
+        session = _aio_sessions[loop] = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=100),
+            timeout=aiohttp.ClientTimeout(connect=3, sock_read=10)
+        )
+    return session
+
+async def send_messenger_message_async(recipient_id, message):
+    """
+    Async variant of send_messenger_message for code running on an event loop.
+    Schedule it with asyncio.create_task(...) to send without waiting for Facebook's response.
+    """
+    try:
+        logging.debug("Recipient ID: %s", recipient_id)
+        data = _build_payload(recipient_id, message)
+
+        session = await _get_aio_session()
+        await MESSENGER_LIMITER.acquire_async()
+        async with session.post(MESSENGER_URL, json=data) as resp:
+            logging.debug("Response status: %s", resp.status)
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug("Response body: %s", await resp.text())
+            resp.raise_for_status()
+
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logging.error("Failed to send message: %s", e)
+    except ValueError as ve:
+        logging.error("Message formatting error: %s", ve)
+
+async def close_async_session():
+    """Close the running event loop's aiohttp session (call before the loop shuts down)."""
+    session = _aio_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
@@ -0,0 +1,67 @@
+import os
+import time
+import asyncio
+import threading
+
+class RateLimiter:
+    """
+    Token bucket for an API's per-minute limits: one bucket of requests and,
+    optionally, one of tokens, both refilled continuously. Limits are per process.
+    """
+
+    def __init__(self, rpm, tpm=None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm or 0)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, est_tokens):
+        """Take one request (and est_tokens) if available; otherwise return the seconds to wait."""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._last
+            self._last = now
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+            if self.tpm:
+                self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+                est_tokens = min(est_tokens, self.tpm)
+            else:
+                est_tokens = 0
+
+            if self._requests >= 1 and self._tokens >= est_tokens:
+                self._requests -= 1
+                self._tokens -= est_tokens
+                return 0
+            wait = (1 - self._requests) * 60 / self.rpm if self._requests < 1 else 0
+            if est_tokens > self._tokens:
+                wait = max(wait, (est_tokens - self._tokens) * 60 / self.tpm)
+            return wait
+
+    def acquire(self, est_tokens=0):
+        """Block the calling thread until the call fits within the limits."""
+        while True:
+            wait = self._reserve(est_tokens)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, est_tokens=0):
+        """Like acquire, but waits without blocking the event loop."""
+        while True:
+            wait = self._reserve(est_tokens)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+def estimate_tokens(messages, max_tokens=None):
+    """Rough token cost of a chat completion: ~4 characters per prompt token plus the reply budget."""
+    prompt_chars = sum(len(message.get("content") or "") for message in messages)
+    return prompt_chars // 4 + (max_tokens or 150)
+
+# Shared OpenAI limiter; set the env values to the account limits divided by the worker count
+OPENAI_LIMITER = RateLimiter(
+    int(os.getenv('OPENAI_RPM', '3500')),
+    int(os.getenv('OPENAI_TPM', '90000'))
+)
@@ -0,0 +1,26 @@
+"""Add bank rate range index
+
+Revision ID: 9b2f4c6d8e10
+Revises: 687d4a4e02a9
+Create Date: 2026-10-15 22:45:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b2f4c6d8e10'
+down_revision = '687d4a4e02a9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('bank_rates', schema=None) as batch_op:
+        batch_op.create_index('ix_bankrate_range_rate', ['min_amount', 'max_amount', 'interest_rate'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('bank_rates', schema=None) as batch_op:
+        batch_op.drop_index('ix_bankrate_range_rate')
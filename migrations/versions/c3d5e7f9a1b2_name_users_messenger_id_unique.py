@@ -0,0 +1,29 @@
+"""Name users.messenger_id unique index
+
+Revision ID: c3d5e7f9a1b2
+Revises: 9b2f4c6d8e10
+Create Date: 2026-10-15 23:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3d5e7f9a1b2'
+down_revision = '9b2f4c6d8e10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Build the named index without blocking writes, then swap it in for the auto-named constraint
+    with op.get_context().autocommit_block():
+        op.create_index('uq_users_messenger_id', 'users', ['messenger_id'], unique=True,
+                        postgresql_concurrently=True, if_not_exists=True)
+    op.execute('ALTER TABLE users DROP CONSTRAINT IF EXISTS users_messenger_id_key')
+    op.execute('ALTER TABLE users ADD CONSTRAINT uq_users_messenger_id UNIQUE USING INDEX uq_users_messenger_id')
+
+
+def downgrade():
+    op.execute('ALTER TABLE users RENAME CONSTRAINT uq_users_messenger_id TO users_messenger_id_key')
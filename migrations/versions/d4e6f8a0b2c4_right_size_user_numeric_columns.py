@@ -0,0 +1,38 @@
+"""Right-size user numeric columns
+
+Revision ID: d4e6f8a0b2c4
+Revises: c3d5e7f9a1b2
+Create Date: 2026-10-15 23:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4e6f8a0b2c4'
+down_revision = 'c3d5e7f9a1b2'
+branch_labels = None
+depends_on = None
+
+MONEY_COLUMNS = (
+    'outstanding_balance', 'original_amount', 'current_monthly_payment',
+    'monthly_savings', 'yearly_savings', 'total_savings', 'temp_cashout_amount',
+)
+YEAR_COLUMNS = ('remaining_tenure', 'original_tenure', 'years_paid', 'tenure')
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        for column in MONEY_COLUMNS:
+            batch_op.alter_column(column, existing_type=sa.Float(), type_=sa.Numeric(12, 2), existing_nullable=True)
+        for column in YEAR_COLUMNS:
+            batch_op.alter_column(column, existing_type=sa.Float(), type_=sa.REAL(), existing_nullable=True)
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        for column in YEAR_COLUMNS:
+            batch_op.alter_column(column, existing_type=sa.REAL(), type_=sa.Float(), existing_nullable=True)
+        for column in MONEY_COLUMNS:
+            batch_op.alter_column(column, existing_type=sa.Numeric(12, 2), type_=sa.Float(), existing_nullable=True)
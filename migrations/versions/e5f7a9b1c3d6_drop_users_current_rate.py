@@ -0,0 +1,27 @@
+"""Drop unused users.current_rate
+
+Revision ID: e5f7a9b1c3d6
+Revises: d4e6f8a0b2c4
+Create Date: 2026-10-15 23:50:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5f7a9b1c3d6'
+down_revision = 'd4e6f8a0b2c4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The chat flow reads and writes current_interest_rate; current_rate was never populated
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('current_rate')
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('current_rate', sa.Float(), nullable=True))
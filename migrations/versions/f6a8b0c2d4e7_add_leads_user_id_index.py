@@ -0,0 +1,28 @@
+"""Add leads user_id index
+
+Revision ID: f6a8b0c2d4e7
+Revises: e5f7a9b1c3d6
+Create Date: 2026-10-16 00:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f6a8b0c2d4e7'
+down_revision = 'e5f7a9b1c3d6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Declared on the model (index=True) but never created by a migration
+    with op.get_context().autocommit_block():
+        op.create_index('ix_leads_user_id', 'leads', ['user_id'], unique=False,
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_leads_user_id', table_name='leads', postgresql_concurrently=True, if_exists=True)